@@ -1,39 +1,139 @@
+import logging
+import math
+import os
+import re
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from database import get_db
+from starlette.concurrency import run_in_threadpool
+from database import get_db, SessionLocal
 from models import User
+from cache import TTLCache
+import data_version
+from data_version import on_stale
+from password_pool import run_password_task
+
+logger = logging.getLogger(__name__)
 
 # Секретный ключ для JWT (в продакшене должен быть в переменных окружения)
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 дней
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Стоимость bcrypt: BCRYPT_ROUNDS задает ее явно, иначе при старте она подбирается
+# под BCRYPT_TARGET_MS (см. calibrate_bcrypt_rounds); скрипты используют значение по умолчанию
+BCRYPT_ROUNDS_ENV = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+# Нижняя граница - стоимость по умолчанию: калибровка может ее только повысить,
+# иначе на медленной машине новые хеши стали бы слабее уже сохраненных
+BCRYPT_MIN_ROUNDS = 12
+BCRYPT_MAX_ROUNDS = 16
+BCRYPT_CALIBRATION_ROUNDS = 8
+bcrypt_rounds = int(BCRYPT_ROUNDS_ENV or BCRYPT_MIN_ROUNDS)
+# $2a$/$2b$/$2y$, стоимость, соль и хеш
+_BCRYPT_HASH_RE = re.compile(r"^\$(2[aby])\$(\d{2})\$[./A-Za-z0-9]{53}$")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Данные пользователя, нужные проверкам доступа (без ORM-объекта и сессии)"""
+    id: int
+    username: str
+    email: str
+    role: str
+    is_active: bool
+    provider_id: Optional[int] = None
+
+    @classmethod
+    def of(cls, user: User) -> "AuthenticatedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            is_active=bool(user.is_active),
+            provider_id=user.provider_id,
+        )
+
+
+# Пользователи по subject токена (username). Этот воркер сбрасывает запись сразу
+# при изменении пользователя, остальные - по версии users или через ttl секунд.
+user_cache = TTLCache(maxsize=1024, ttl=30, name="auth_users")
+
+
+def invalidate_user(*usernames):
+    """Сбрасывает закешированных пользователей (без аргументов - всех)"""
+    if not usernames:
+        user_cache.clear()
+    for username in usernames:
+        user_cache.pop(username)
+
+
+on_stale(data_version.USERS, lambda db: invalidate_user())
+
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt учитывает только первые 72 байта (новые версии пакета на длинных паролях падают)
+    return password.encode("utf-8")[:72]
+
+def parse_password_hash(hashed_password: str):
+    """Схема и стоимость хеша: ("bcrypt", rounds) или (None, None) для неизвестного формата"""
+    match = _BCRYPT_HASH_RE.match(hashed_password or "")
+    if not match:
+        return None, None
+    return "bcrypt", int(match.group(2))
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля с поддержкой обоих форматов (passlib и прямой bcrypt)"""
+    """Проверка пароля: ровно одна проверка bcrypt (хеши passlib и прямого bcrypt совпадают по формату)"""
+    scheme, _ = parse_password_hash(hashed_password)
+    if scheme != "bcrypt":
+        return False
     try:
-        # Сначала пробуем через passlib
-        return pwd_context.verify(plain_password, hashed_password)
-    except Exception:
-        # Если не работает, пробуем прямой bcrypt
-        try:
-            import bcrypt
-            password_bytes = plain_password.encode('utf-8')
-            if len(password_bytes) > 72:
-                password_bytes = password_bytes[:72]
-            return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
-        except Exception:
-            return False
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode("utf-8"))
+    except ValueError:
+        return False
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(bcrypt_rounds)).decode("utf-8")
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Хеш старого варианта ($2a$, $2y$) или с меньшей стоимостью, чем текущая"""
+    scheme, rounds = parse_password_hash(hashed_password)
+    return scheme == "bcrypt" and (not hashed_password.startswith("$2b$") or rounds < bcrypt_rounds)
+
+def calibrate_bcrypt_rounds(target_ms: float = BCRYPT_TARGET_MS) -> int:
+    """
+    Подбирает стоимость bcrypt, при которой хеширование занимает не больше target_ms на этой машине.
+    Время удваивается с каждым раундом, поэтому достаточно одного замера на малой стоимости.
+    """
+    global bcrypt_rounds
+    if BCRYPT_ROUNDS_ENV:
+        bcrypt_rounds = int(BCRYPT_ROUNDS_ENV)
+        return bcrypt_rounds
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(BCRYPT_CALIBRATION_ROUNDS))
+    elapsed_ms = max((time.perf_counter() - start) * 1000, 0.001)
+    rounds = BCRYPT_CALIBRATION_ROUNDS + int(math.floor(math.log2(target_ms / elapsed_ms)))
+    bcrypt_rounds = max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+    logger.info(f"bcrypt cost calibrated: {bcrypt_rounds} (target {target_ms} ms)")
+    return bcrypt_rounds
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash в пуле паролей (для async endpoints)"""
+    return await run_password_task(get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password в пуле паролей (для async endpoints)"""
+    return await run_password_task(verify_password, plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -59,6 +159,42 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
+def _replace_password_hash(user_id: int, old_hash: str, new_hash: str) -> bool:
+    """Compare-and-set: хеш меняется, только если его не успели изменить с момента входа"""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(User)
+            .where(User.id == user_id, User.password_hash == old_hash)
+            .values(password_hash=new_hash)
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+async def rehash_password_if_needed(user_id: int, old_hash: str, password: str):
+    """Фоновая замена устаревшего хеша после успешного входа"""
+    if not password_needs_rehash(old_hash):
+        return
+    try:
+        new_hash = await get_password_hash_async(password)
+    except HTTPException:
+        # Пул паролей перегружен: обновим при следующем входе
+        return
+    if await run_in_threadpool(_replace_password_hash, user_id, old_hash, new_hash):
+        logger.info(f"Password hash upgraded for user {user_id}")
+
+async def authenticate_user_async(db: Session, username: str, password: str):
+    """authenticate_user с проверкой пароля в пуле паролей"""
+    # Запрос к БД синхронный: в threadpool, чтобы не блокировать event loop
+    user = await run_in_threadpool(get_user_by_username, db, username)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.password_hash):
+        return False
+    return user
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -72,14 +208,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(db, username=username)
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        db_user = get_user_by_username(db, username=username)
+        if db_user is None:
+            raise credentials_exception
+        user = AuthenticatedUser.of(db_user)
+        user_cache.set(username, user)
     if not user.is_active:
         raise HTTPException(status_code=403, detail="User is inactive")
     return user
 
-async def get_current_admin(current_user: User = Depends(get_current_user)):
+async def get_current_admin(current_user: AuthenticatedUser = Depends(get_current_user)):
     """Проверка прав администратора"""
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(
@@ -88,7 +228,7 @@ async def get_current_admin(current_user: User = Depends(get_current_user)):
         )
     return current_user
 
-async def get_current_super_admin(current_user: User = Depends(get_current_user)):
+async def get_current_super_admin(current_user: AuthenticatedUser = Depends(get_current_user)):
     """Проверка прав супер-администратора"""
     if current_user.role != "super_admin":
         raise HTTPException(
@@ -0,0 +1,84 @@
+"""
+Бенчмарк: фильтр по радиусу циклом Python (как в get_providers) против NumPy-снимка.
+
+Запуск: python bench_geo.py [размеры...]   (по умолчанию 10000 100000 1000000)
+Замеряется только фильтрация: в endpoint цикл дополнительно платит за загрузку
+ORM-объектов всех активных провайдеров, так что реальный выигрыш больше.
+"""
+import random
+import sys
+import time
+
+from geo_snapshot import ProviderSnapshot, np
+
+CATEGORIES = ["cargo", "plumber", "tow_truck", "electrician"]
+# Бишкек, радиус ~5 км в градусах
+QUERY = (42.87, 74.59, 0.05)
+REPEATS = 5
+
+
+class FakeProvider:
+    __slots__ = ("id", "latitude", "longitude", "category")
+
+    def __init__(self, provider_id, latitude, longitude, category):
+        self.id = provider_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.category = category
+
+
+def make_providers(count: int):
+    rnd = random.Random(42)
+    # Территория Кыргызстана
+    return [
+        FakeProvider(i, rnd.uniform(39.2, 43.3), rnd.uniform(69.2, 80.3), rnd.choice(CATEGORIES))
+        for i in range(1, count + 1)
+    ]
+
+
+def loop_filter(providers, lat, lng, radius):
+    filtered_providers = []
+    for provider in providers:
+        distance = ((provider.latitude - lat) ** 2 + (provider.longitude - lng) ** 2) ** 0.5
+        if distance <= radius:
+            filtered_providers.append(provider)
+    return filtered_providers
+
+
+def best_of(fn):
+    best = float("inf")
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    if np is None:
+        print("numpy не установлен: pip install numpy")
+        return
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    lat, lng, radius = QUERY
+
+    print(f"{'rows':>10} {'loop, ms':>10} {'numpy, ms':>10} {'speedup':>8} {'load, ms':>10} {'found':>7}")
+    for size in sizes:
+        providers = make_providers(size)
+        snapshot = ProviderSnapshot()
+        load_start = time.perf_counter()
+        data = snapshot.load((p.id, p.latitude, p.longitude, p.category) for p in providers)
+        load_time = time.perf_counter() - load_start
+
+        loop_time, loop_result = best_of(lambda: loop_filter(providers, lat, lng, radius))
+        numpy_time, numpy_result = best_of(lambda: data.radius_ids(lat, lng, radius))
+        assert [p.id for p in loop_result] == numpy_result.tolist()
+
+        print(
+            f"{size:>10} {loop_time * 1000:>10.2f} {numpy_time * 1000:>10.2f} "
+            f"{loop_time / numpy_time:>7.1f}x {load_time * 1000:>10.1f} {len(numpy_result):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Бенчмарк: сериализация списка провайдеров через ORM + Pydantic (как в get_providers)
+против кортежей колонок + fast_json (FAST_JSON=1).
+
+Запуск: python bench_serialization.py [размеры...]   (по умолчанию 1000 10000 100000)
+Замеряется запрос к БД в памяти и кодирование в байты; результаты обоих путей
+сравниваются после разбора JSON.
+"""
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import ServiceProvider
+from schemas import ServiceProviderResponse
+from sparse_fields import PROVIDER_FIELDS, provider_columns
+from fast_json import encode_rows, orjson
+
+CATEGORIES = ["cargo", "plumber", "tow_truck", "electrician"]
+REPEATS = 3
+
+_list_adapter = TypeAdapter(List[ServiceProviderResponse])
+
+
+def make_session(count: int):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[ServiceProvider.__table__])
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+    rows = [
+        {
+            "name": f"Провайдер {i}",
+            "category": rnd.choice(CATEGORIES),
+            "description": "Описание услуги. " * rnd.randint(5, 40),
+            "latitude": rnd.uniform(39.2, 43.3),
+            "longitude": rnd.uniform(69.2, 80.3),
+            "phone": f"+996 555 {i:06d}",
+            "email": f"provider{i}@example.kg",
+            "address": f"ул. Примерная, {i}",
+            "is_active": True,
+            "created_at": start + timedelta(seconds=i),
+            "updated_at": start + timedelta(seconds=i, microseconds=i % 1000),
+        }
+        for i in range(1, count + 1)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(ServiceProvider), rows)
+    return sessionmaker(bind=engine)()
+
+
+def pydantic_path(db):
+    providers = db.query(ServiceProvider).filter(ServiceProvider.is_active == True).order_by(ServiceProvider.id).all()
+    content = _list_adapter.dump_json(_list_adapter.validate_python(providers, from_attributes=True))
+    db.expunge_all()
+    return content
+
+
+def fast_path(db):
+    rows = (
+        db.query(*provider_columns(PROVIDER_FIELDS))
+        .filter(ServiceProvider.is_active == True)
+        .order_by(ServiceProvider.id)
+        .all()
+    )
+    return encode_rows(rows, PROVIDER_FIELDS)
+
+
+def best_of(fn):
+    best = float("inf")
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    print(f"encoder: {'orjson' if orjson else 'json'}")
+    print(f"{'rows':>8} {'pydantic, ms':>13} {'fast, ms':>10} {'speedup':>8} {'bytes':>10}")
+    for size in sizes:
+        db = make_session(size)
+        pydantic_time, pydantic_result = best_of(lambda: pydantic_path(db))
+        fast_time, fast_result = best_of(lambda: fast_path(db))
+        assert json.loads(pydantic_result) == json.loads(fast_result)
+        print(
+            f"{size:>8} {pydantic_time * 1000:>13.1f} {fast_time * 1000:>10.1f} "
+            f"{pydantic_time / fast_time:>7.1f}x {len(fast_result):>10}"
+        )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
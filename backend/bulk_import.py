@@ -0,0 +1,164 @@
+"""
+Массовый импорт провайдеров из CSV или NDJSON.
+
+Файл читается потоком, строки валидируются ServiceProviderCreate пачками по
+batch_size и вставляются одним executemany в отдельной транзакции на пачку.
+Индексы, версии данных и кеши обновляются один раз на пачку (callback on_batch),
+а не на каждую строку. Ошибочные строки пропускаются и попадают в отчет.
+"""
+import codecs
+import csv
+import json
+import logging
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+import data_version
+from data_version import commit_versioned
+from geo import ProviderPoint
+from models import ServiceProvider
+from schemas import ServiceProviderCreate
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_BATCH_SIZE = 500
+# Сколько ошибок строк возвращать в отчете
+MAX_IMPORT_ERRORS = 1000
+
+_RETURNING = (
+    ServiceProvider.id,
+    ServiceProvider.latitude,
+    ServiceProvider.longitude,
+    ServiceProvider.category,
+    ServiceProvider.is_active,
+    ServiceProvider.name,
+)
+
+
+def detect_format(filename, fmt=None) -> str:
+    if fmt is None and filename:
+        suffix = filename.rsplit(".", 1)[-1].lower()
+        fmt = {"jsonl": "ndjson", "json": "ndjson"}.get(suffix, suffix)
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+
+def _text_lines(fileobj, position):
+    """
+    Строки бинарного файла, декодированные по одной: ошибка кодировки относится к своей
+    строке, а не ко всему прочитанному блоку. position[0] - номер последней строки.
+    """
+    for line_no, line in enumerate(fileobj, start=1):
+        position[0] = line_no
+        if line_no == 1:
+            # BOM, который добавляет Excel
+            line = line.removeprefix(codecs.BOM_UTF8)
+        yield line.decode("utf-8")
+
+
+def iter_records(fileobj, fmt: str):
+    """
+    Потоково читает бинарный файл: (номер строки, dict или текст ошибки).
+    На строке не в UTF-8 чтение останавливается с ошибкой этой строки.
+    """
+    position = [0]
+    lines = _text_lines(fileobj, position)
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(lines)
+            for record in reader:
+                # Пустые ячейки - отсутствующие значения
+                yield reader.line_num, {
+                    key: value for key, value in record.items() if key and value not in ("", None)
+                }
+        else:
+            for line in lines:
+                line_no = position[0]
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield line_no, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(record, dict):
+                    yield line_no, "Expected a JSON object"
+                    continue
+                yield line_no, record
+    except UnicodeDecodeError:
+        yield position[0], "File must be UTF-8 encoded; import stopped at this row"
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _insert_batch(db, batch, report: ImportReport, on_batch):
+    rows = [values for _, values in batch]
+    try:
+        inserted = db.execute(insert(ServiceProvider).returning(*_RETURNING), rows).all()
+        commit_versioned(db, data_version.PROVIDERS)
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Bulk import batch failed: {e}")
+        for row_no, _ in batch:
+            report.error(row_no, "Database error")
+        return
+    report.inserted += len(inserted)
+    on_batch([(None, ProviderPoint(*row)) for row in inserted])
+
+
+def import_providers(db, records, on_batch, categories=None, batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    Валидирует и вставляет записи из iter_records.
+    on_batch(changes) вызывается после коммита каждой пачки; categories - допустимые категории.
+    """
+    report = ImportReport()
+    batch = []
+    for row_no, record in records:
+        if isinstance(record, str):
+            report.error(row_no, record)
+            continue
+        try:
+            provider = ServiceProviderCreate.model_validate(record)
+        except ValidationError as e:
+            report.error(row_no, _format_validation_error(e))
+            continue
+        if categories is not None and provider.category not in categories:
+            report.error(row_no, f"category: unknown category '{provider.category}'")
+            continue
+        batch.append((row_no, provider.model_dump()))
+        if len(batch) >= batch_size:
+            _insert_batch(db, batch, report, on_batch)
+            batch = []
+    if batch:
+        _insert_batch(db, batch, report, on_batch)
+    logger.info(f"Bulk import: {report.inserted} inserted, {report.failed} failed")
+    return report
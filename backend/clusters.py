@@ -0,0 +1,161 @@
+"""
+Серверная кластеризация провайдеров по уровням зума.
+
+Для каждого зума мир делится на квадратную (в градусах) сетку: тайл карты 256px
+разбивается на 4x4 ячейки, то есть ячейка около 64px. Таблица provider_clusters
+хранит по ячейке и категории количество активных провайдеров и суммы координат,
+а триггеры на service_providers обновляют ее инкрементально при каждой записи.
+"""
+import logging
+
+from sqlalchemy import text, func
+
+from models import ProviderCluster
+
+logger = logging.getLogger(__name__)
+
+MAX_CLUSTER_ZOOM = 16
+# 2^2 ячейки на сторону тайла
+CELLS_PER_TILE_SHIFT = 2
+CLUSTER_TABLE = ProviderCluster.__tablename__
+
+
+def _cells_per_degree(zoom: int) -> float:
+    return (1 << (zoom + CELLS_PER_TILE_SHIFT)) / 360.0
+
+
+def cell_x(lng: float, zoom: int) -> int:
+    return int((lng + 180.0) * _cells_per_degree(zoom))
+
+
+def cell_y(lat: float, zoom: int) -> int:
+    return int((90.0 - lat) * _cells_per_degree(zoom))
+
+
+def _cell_sql(row: str, zoom: int) -> str:
+    """SQL-выражения ячейки для NEW/OLD строки (CAST отбрасывает дробную часть, как int())"""
+    scale = f"{1 << (zoom + CELLS_PER_TILE_SHIFT)} / 360.0"
+    return (
+        f"CAST(({row}.longitude + 180.0) * {scale} AS INTEGER), "
+        f"CAST((90.0 - {row}.latitude) * {scale} AS INTEGER)"
+    )
+
+
+def _add_statement() -> str:
+    values = ",\n".join(
+        f"({zoom}, {_cell_sql('NEW', zoom)}, NEW.category, 1, NEW.latitude, NEW.longitude)"
+        for zoom in range(MAX_CLUSTER_ZOOM + 1)
+    )
+    return f"""
+        INSERT INTO {CLUSTER_TABLE} (zoom, x, y, category, count, sum_lat, sum_lng)
+        VALUES {values}
+        ON CONFLICT (zoom, x, y, category) DO UPDATE SET
+            count = count + 1,
+            sum_lat = sum_lat + excluded.sum_lat,
+            sum_lng = sum_lng + excluded.sum_lng;
+    """
+
+
+def _remove_statements() -> str:
+    # Пустые ячейки не удаляем: их немного, а запрос отбрасывает count = 0
+    return "\n".join(
+        f"""
+        UPDATE {CLUSTER_TABLE}
+        SET count = count - 1, sum_lat = sum_lat - OLD.latitude, sum_lng = sum_lng - OLD.longitude
+        WHERE zoom = {zoom} AND (x, y) = ({_cell_sql('OLD', zoom)}) AND category = OLD.category;
+        """
+        for zoom in range(MAX_CLUSTER_ZOOM + 1)
+    )
+
+
+def _cluster_triggers():
+    watched = "latitude, longitude, category, is_active"
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {CLUSTER_TABLE}_ai
+        AFTER INSERT ON service_providers WHEN NEW.is_active
+        BEGIN {_add_statement()} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {CLUSTER_TABLE}_au_old
+        AFTER UPDATE OF {watched} ON service_providers WHEN OLD.is_active
+        BEGIN {_remove_statements()} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {CLUSTER_TABLE}_au_new
+        AFTER UPDATE OF {watched} ON service_providers WHEN NEW.is_active
+        BEGIN {_add_statement()} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {CLUSTER_TABLE}_ad
+        AFTER DELETE ON service_providers WHEN OLD.is_active
+        BEGIN {_remove_statements()} END
+        """,
+    ]
+
+
+def rebuild_clusters(conn):
+    """Полностью пересчитывает таблицу кластеров по service_providers"""
+    conn.execute(text(f"DELETE FROM {CLUSTER_TABLE}"))
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        scale = f"{1 << (zoom + CELLS_PER_TILE_SHIFT)} / 360.0"
+        conn.execute(text(f"""
+            INSERT INTO {CLUSTER_TABLE} (zoom, x, y, category, count, sum_lat, sum_lng)
+            SELECT {zoom}, cx, cy, category, COUNT(*), SUM(latitude), SUM(longitude)
+            FROM (
+                SELECT CAST((longitude + 180.0) * {scale} AS INTEGER) AS cx,
+                       CAST((90.0 - latitude) * {scale} AS INTEGER) AS cy,
+                       category, latitude, longitude
+                FROM service_providers WHERE is_active
+            )
+            GROUP BY cx, cy, category
+        """))
+
+
+def init_cluster_index(engine) -> bool:
+    """Создает триггеры кластеров, при первом создании заполняет таблицу"""
+    if engine.dialect.name != "sqlite":
+        logger.info("Cluster triggers are only available for SQLite")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                {"name": f"{CLUSTER_TABLE}_ai"},
+            ).first()
+            for ddl in _cluster_triggers():
+                conn.execute(text(ddl))
+            if not exists:
+                rebuild_clusters(conn)
+    except Exception as e:
+        logger.error(f"Error creating cluster index: {e}", exc_info=True)
+        return False
+
+    logger.info("Cluster index is ready")
+    return True
+
+
+def query_clusters(db, south, west, north, east, zoom: int, category=None, limit: int = 5000):
+    """Возвращает центроиды и количество провайдеров по ячейкам в прямоугольнике"""
+    zoom = max(0, min(zoom, MAX_CLUSTER_ZOOM))
+    total = func.sum(ProviderCluster.count)
+    query = db.query(
+        total,
+        func.sum(ProviderCluster.sum_lat),
+        func.sum(ProviderCluster.sum_lng),
+    ).filter(
+        ProviderCluster.zoom == zoom,
+        ProviderCluster.x.between(cell_x(west, zoom), cell_x(east, zoom)),
+        ProviderCluster.y.between(cell_y(north, zoom), cell_y(south, zoom)),
+        ProviderCluster.count > 0,
+    )
+    if category:
+        query = query.filter(ProviderCluster.category == category)
+
+    rows = query.group_by(ProviderCluster.x, ProviderCluster.y).limit(limit + 1).all()
+    clusters = [
+        {"lat": sum_lat / count, "lng": sum_lng / count, "count": count}
+        for count, sum_lat, sum_lng in rows[:limit]
+    ]
+    return zoom, clusters, len(rows) > limit
@@ -3,8 +3,7 @@
 """
 from database import SessionLocal, engine, Base
 from models import User
-from auth import get_user_by_username, get_user_by_email
-import bcrypt
+from auth import get_password_hash, get_user_by_username, get_user_by_email
 
 def create_admin():
     Base.metadata.create_all(bind=engine)
@@ -35,12 +34,7 @@ def create_admin():
             return
         
         print(f"Создаем супер-администратора: {username}")
-        # Используем прямой вызов bcrypt для обхода проблемы с passlib
-        password_bytes = password.encode('utf-8')
-        if len(password_bytes) > 72:
-            password_bytes = password_bytes[:72]
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+        password_hash = get_password_hash(password)
         
         superadmin = User(
             username=username,
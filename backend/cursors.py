@@ -0,0 +1,53 @@
+"""
+Непрозрачные курсоры для постраничной выдачи и ленты изменений
+"""
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data
+
+
+# Курсор следующей страницы отдается в заголовке, тело ответа остается списком
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def decode_id_cursor(cursor: str) -> int:
+    """id последней строки предыдущей страницы"""
+    data = decode_cursor(cursor)
+    try:
+        return int(data["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate_by_id(query, id_column, cursor, limit):
+    """
+    Keyset-пагинация по возрастанию id: (rows, next_cursor).
+    limit=None - вся выдача без курсора, как раньше.
+    """
+    if cursor:
+        query = query.filter(id_column > decode_id_cursor(cursor))
+    query = query.order_by(id_column)
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor({"id": rows[-1].id})
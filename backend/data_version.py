@@ -0,0 +1,106 @@
+"""
+Общий для всех воркеров счетчик версии данных.
+
+Каждая запись провайдеров, категорий или пользователей увеличивает строку в
+data_versions в той же транзакции (commit_versioned). Воркер помнит последнюю
+увиденную версию и раз за запрос (зависимость get_synced_db) сверяет ее с БД: если
+данные поменял другой воркер, вызываются обработчики on_stale, которые сбрасывают
+локальные кеши.
+"""
+import logging
+import threading
+
+from fastapi import Depends
+from sqlalchemy import select, update, insert
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = "providers"
+CATEGORIES = "categories"
+USERS = "users"
+DATA_VERSION_NAMES = (PROVIDERS, CATEGORIES, USERS)
+
+_lock = threading.Lock()
+# Версии, до которых синхронизированы локальные кеши этого процесса
+_seen = {}
+_listeners = {name: [] for name in DATA_VERSION_NAMES}
+
+
+def init_data_versions(engine):
+    """Создает строки счетчиков, если их еще нет"""
+    with engine.begin() as conn:
+        for name in DATA_VERSION_NAMES:
+            conn.execute(
+                insert(DataVersion).prefix_with("OR IGNORE").values(name=name, version=0)
+            )
+
+
+def on_stale(name: str, callback):
+    """Регистрирует callback(db), который сбрасывает локальные данные при чужой записи"""
+    _listeners[name].append(callback)
+
+
+def _reset(db: Session, name: str, version: int):
+    """Вызывается под блокировкой: сбрасывает локальные данные и запоминает версию"""
+    for callback in _listeners[name]:
+        callback(db)
+    _seen[name] = version
+
+
+def bump(db: Session, name: str) -> int:
+    """Увеличивает версию в текущей транзакции и возвращает новое значение"""
+    # Изменения сессии пишутся до увеличения: change_seq провайдеров берет версию,
+    # которую получит транзакция (models.NEXT_PROVIDERS_VERSION)
+    db.flush()
+    result = db.execute(
+        update(DataVersion)
+        .where(DataVersion.name == name)
+        .values(version=DataVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        # Скрипты могут писать раньше, чем приложение создаст строки счетчиков
+        db.execute(insert(DataVersion).values(name=name, version=1))
+    return db.execute(select(DataVersion.version).where(DataVersion.name == name)).scalar_one()
+
+
+def commit_versioned(db: Session, name: str) -> int:
+    """
+    Коммитит транзакцию вместе с увеличением версии name.
+    Если между нашей предыдущей и новой версией писал другой воркер, кеши сбрасываются.
+    """
+    version = bump(db, name)
+    db.commit()
+    with _lock:
+        if _seen.get(name) == version - 1:
+            _seen[name] = version
+        else:
+            _reset(db, name, version)
+    return version
+
+
+def sync(db: Session):
+    """Сверяет локальные версии с БД и сбрасывает устаревшие кеши"""
+    versions = dict(db.execute(select(DataVersion.name, DataVersion.version)).all())
+    with _lock:
+        for name in DATA_VERSION_NAMES:
+            version = versions.get(name, 0)
+            if _seen.get(name) != version:
+                _reset(db, name, version)
+
+
+def current_version(name: str):
+    """Версия, с которой синхронизированы локальные кеши (None до первой синхронизации)"""
+    return _seen.get(name)
+
+
+def get_synced_db(db: Session = Depends(get_db)) -> Session:
+    """Зависимость: сессия БД после сверки версий (FastAPI вызывает ее один раз за запрос)"""
+    try:
+        sync(db)
+    except Exception as e:
+        logger.warning(f"Data version check failed: {e}")
+    return db
@@ -0,0 +1,30 @@
+"""
+Скрипт для сборки статических снимков данных провайдеров (см. snapshots.py)
+
+Запуск: python export_snapshots.py [каталог]   (по умолчанию SNAPSHOT_DIR)
+Например, для фронтенда на GitHub Pages: python export_snapshots.py ../docs/snapshots
+"""
+import sys
+
+from database import SessionLocal
+from snapshots import SnapshotWriter, SNAPSHOT_DIR
+
+
+def export_snapshots(directory):
+    db = SessionLocal()
+    try:
+        manifest = SnapshotWriter(directory).rebuild(db)
+    finally:
+        db.close()
+    print(
+        f"Снимки записаны в {directory}: версия {manifest['version']}, "
+        f"{len(manifest['categories'])} категорий, {len(manifest['tiles'])} тайлов."
+    )
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_DIR
+    if not directory:
+        print("Укажите каталог: python export_snapshots.py <каталог> или переменную SNAPSHOT_DIR")
+        sys.exit(1)
+    export_snapshots(directory)
@@ -0,0 +1,71 @@
+"""
+Потоковые выгрузки для админки: все провайдеры (NDJSON) и все сообщения (CSV).
+
+Генераторы читают таблицу keyset-пачками (id > последнего, ORDER BY id, LIMIT) -
+каждая пачка отдельным коротким запросом в своей сессии (сессия запроса закрывается
+раньше, чем отдается тело ответа) - и отдают по одному чанку на пачку, так что память
+не растет с размером таблицы. Курсор не остается открытым, пока медленный клиент
+скачивает ответ: иначе его SHARED-блокировка SQLite не давала бы писать в БД.
+"""
+import csv
+import io
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import ServiceProvider, Message
+from fast_json import encode_row
+from sparse_fields import PROVIDER_FIELDS, provider_columns
+
+EXPORT_BATCH_SIZE = 1000
+MESSAGE_EXPORT_FIELDS = (
+    "id", "provider_id", "client_name", "client_phone", "client_email", "message_text", "created_at",
+)
+
+
+def _partitions(query, id_column, batch_size: int):
+    """Пачки строк по возрастанию id; id_column должен быть среди колонок запроса"""
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.where(id_column > last_id)
+        with SessionLocal() as db:
+            rows = db.execute(batch_query.order_by(id_column).limit(batch_size)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]._mapping[id_column]
+
+
+def providers_ndjson(batch_size: int = EXPORT_BATCH_SIZE):
+    """Все провайдеры (включая неактивных), одна JSON-строка на провайдера"""
+    query = select(*provider_columns(PROVIDER_FIELDS))
+    for rows in _partitions(query, ServiceProvider.id, batch_size):
+        yield b"".join(encode_row(row, PROVIDER_FIELDS) + b"\n" for row in rows)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def messages_csv(batch_size: int = EXPORT_BATCH_SIZE):
+    """Все сообщения в CSV с заголовком"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM - чтобы Excel открыл кириллицу в UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(MESSAGE_EXPORT_FIELDS)
+    yield buffer.getvalue().encode("utf-8")
+
+    columns = [getattr(Message, name) for name in MESSAGE_EXPORT_FIELDS]
+    query = select(*columns)
+    for rows in _partitions(query, Message.id, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,47 @@
+"""
+Быстрая сериализация провайдеров без Pydantic (включается FAST_JSON=1).
+
+Строки читаются Core-запросом как кортежи колонок и сразу кодируются в байты
+(orjson, если установлен, иначе стандартный json). Схема ответа та же, что у
+ServiceProviderResponse: те же поля в том же порядке, datetime в ISO 8601.
+Валидация пропускается - данные уже проверены при записи.
+"""
+import json
+import logging
+import os
+from datetime import date
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FAST_JSON = os.getenv("FAST_JSON", "").lower() in ("1", "true", "yes")
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_row(row, fields) -> bytes:
+    """Один объект из кортежа значений колонок fields"""
+    return dumps(dict(zip(fields, row)))
+
+
+def encode_rows(rows, fields) -> bytes:
+    """JSON-массив объектов из кортежей значений колонок fields"""
+    return dumps([dict(zip(fields, row)) for row in rows])
+
+
+if FAST_JSON:
+    logger.info(f"Fast JSON serialization enabled ({'orjson' if orjson else 'json'})")
@@ -1,5 +1,5 @@
 """
-Скрипт для исправления пароля админа, чтобы он работал с passlib
+Скрипт для сброса пароля админа
 """
 from database import SessionLocal
 from models import User
@@ -15,7 +15,6 @@ def fix_admin_password():
             return
         
         print("Обновляем пароль администратора...")
-        # Пересоздаем хеш через passlib
         admin.password_hash = get_password_hash('admin123')
         db.commit()
         print("[OK] Пароль администратора обновлен")
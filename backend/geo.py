@@ -0,0 +1,264 @@
+"""
+Пространственный индекс провайдеров (SQLite R*Tree)
+"""
+import heapq
+import logging
+import math
+from typing import NamedTuple
+
+from fastapi import HTTPException
+from sqlalchemy import Table, Column, Integer, Float, MetaData, text
+from sqlalchemy.sql.expression import UnaryExpression
+from sqlalchemy.sql.operators import custom_op
+
+from models import ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+SPATIAL_INDEX_TABLE = "service_providers_rtree"
+
+# Отдельные метаданные: виртуальную таблицу создает init_spatial_index, а не create_all
+_spatial_metadata = MetaData()
+
+provider_rtree = Table(
+    SPATIAL_INDEX_TABLE,
+    _spatial_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_lng", Float),
+    Column("max_lng", Float),
+)
+
+# Индекс хранит только активных провайдеров и поддерживается триггерами,
+# поэтому create, update, toggle и delete (в том числе из скриптов) не требуют кода в endpoints
+_SPATIAL_INDEX_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_ai
+    AFTER INSERT ON service_providers WHEN NEW.is_active
+    BEGIN
+        INSERT OR REPLACE INTO {SPATIAL_INDEX_TABLE}
+        VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_au
+    AFTER UPDATE OF latitude, longitude, is_active ON service_providers
+    BEGIN
+        DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.id;
+        INSERT INTO {SPATIAL_INDEX_TABLE}
+        SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.is_active;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_ad
+    AFTER DELETE ON service_providers
+    BEGIN
+        DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.id;
+    END
+    """,
+]
+
+EARTH_RADIUS_M = 6371008.8
+# Поиск ближайших начинается с этого радиуса и расширяется в NEAREST_GROWTH раз
+NEAREST_START_RADIUS_M = 1000.0
+NEAREST_GROWTH = 4.0
+# Предел широты web mercator
+MAX_MERCATOR_LAT = 85.05112878
+
+
+class ProviderPoint(NamedTuple):
+    """Состояние провайдера, важное для гео-индексов и кешей (до или после записи)"""
+    id: int
+    latitude: float
+    longitude: float
+    category: str
+    is_active: bool
+    name: str
+
+    @classmethod
+    def of(cls, provider) -> "ProviderPoint":
+        return cls(
+            provider.id,
+            provider.latitude,
+            provider.longitude,
+            provider.category,
+            bool(provider.is_active),
+            provider.name,
+        )
+
+
+# Включается в init_spatial_index; без него запросы фильтруют по колонкам latitude/longitude
+spatial_index_enabled = False
+
+
+def init_spatial_index(engine) -> bool:
+    """Создает R*Tree индекс и триггеры, при первом создании заполняет его"""
+    global spatial_index_enabled
+    if engine.dialect.name != "sqlite":
+        logger.info("Spatial index is only available for SQLite, using column filters")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": SPATIAL_INDEX_TABLE},
+            ).first()
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SPATIAL_INDEX_TABLE} "
+                "USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+            ))
+            for ddl in _SPATIAL_INDEX_TRIGGERS:
+                conn.execute(text(ddl))
+            if not exists:
+                # Заполняем индекс для уже существующих провайдеров
+                conn.execute(text(
+                    f"INSERT OR REPLACE INTO {SPATIAL_INDEX_TABLE} "
+                    "SELECT id, latitude, latitude, longitude, longitude "
+                    "FROM service_providers WHERE is_active"
+                ))
+    except Exception as e:
+        logger.error(f"Error creating spatial index: {e}", exc_info=True)
+        return False
+
+    spatial_index_enabled = True
+    logger.info("Spatial index is ready")
+    return True
+
+
+def _filter_category(query, category):
+    column = ServiceProvider.category
+    if spatial_index_enabled:
+        # Унарный плюс отключает индекс по category: иначе SQLite ведет запрос по нему
+        # и перебирает R*Tree для каждого провайдера категории, а не наоборот
+        column = UnaryExpression(column.expression, operator=custom_op("+"), type_=column.type)
+    return query.filter(column == category)
+
+
+def filter_in_bbox(query, south: float, west: float, north: float, east: float, category=None):
+    """
+    Ограничивает запрос провайдерами внутри прямоугольника (в градусах) и, если задана,
+    категорией: фильтр по категории нужно передавать сюда, чтобы запрос вел R*Tree
+    """
+    if category:
+        query = _filter_category(query, category)
+    if spatial_index_enabled:
+        query = query.join(provider_rtree, provider_rtree.c.id == ServiceProvider.id).filter(
+            provider_rtree.c.min_lat <= north,
+            provider_rtree.c.max_lat >= south,
+            provider_rtree.c.min_lng <= east,
+            provider_rtree.c.max_lng >= west,
+        )
+    # R*Tree хранит координаты во float32 с округлением наружу, поэтому точная проверка остается
+    return query.filter(
+        ServiceProvider.latitude.between(south, north),
+        ServiceProvider.longitude.between(west, east),
+    )
+
+
+def filter_in_radius(query, lat: float, lng: float, radius: float, category=None):
+    """Ограничивает запрос провайдерами в радиусе (евклидово расстояние в градусах) и категорией"""
+    query = filter_in_bbox(query, lat - radius, lng - radius, lat + radius, lng + radius, category)
+    d_lat = ServiceProvider.latitude - lat
+    d_lng = ServiceProvider.longitude - lng
+    return query.filter(d_lat * d_lat + d_lng * d_lng <= radius * radius)
+
+
+def normalize_bbox(south: float, west: float, north: float, east: float):
+    """Проверяет прямоугольник и обрезает его до допустимых координат"""
+    if south > north or west > east:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    # Leaflet при прокрутке мира может вернуть долготу за пределами [-180, 180]
+    return (
+        max(south, -90.0),
+        max(west, -180.0),
+        min(north, 90.0),
+        min(east, 180.0),
+    )
+
+
+def parse_bbox(bbox: str):
+    """Разбирает bbox в формате Leaflet toBBoxString(): "west,south,east,north" """
+    try:
+        west, south, east, north = (float(part) for part in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be 'west,south,east,north'")
+    return normalize_bbox(south, west, north, east)
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расстояние по большому кругу в метрах"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_around(lat: float, lng: float, radius_m: float):
+    """Прямоугольник (south, west, north, east), содержащий круг радиуса radius_m"""
+    distance = radius_m / EARTH_RADIUS_M  # угловое расстояние в радианах
+    d_lat = math.degrees(distance)
+    south = lat - d_lat
+    north = lat + d_lat
+    # Крайние по долготе точки круга на сфере: sin(d_lng) = sin(d) / cos(lat);
+    # d_lat / cos(lat) занижает полуширину у высоких широт и больших радиусов
+    sin_d = math.sin(distance)
+    cos_lat = math.cos(math.radians(lat))
+    d_lng = math.degrees(math.asin(sin_d / cos_lat)) if sin_d < cos_lat else 360.0
+    if south <= -90 or north >= 90 or lng - d_lng < -180 or lng + d_lng > 180:
+        # Круг захватывает полюс или переходит через антимеридиан: берем всю долготу
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    return south, lng - d_lng, north, lng + d_lng
+
+
+def mercator_xy(lat: float, lng: float, zoom: int):
+    """Дробные координаты тайла web mercator (x вправо, y вниз) для точки"""
+    n = 1 << zoom
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lng + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_of(lat: float, lng: float, zoom: int):
+    """Координаты тайла (x, y) web mercator, в котором лежит точка"""
+    n = 1 << zoom
+    x, y = mercator_xy(lat, lng, zoom)
+    return min(max(int(x), 0), n - 1), min(max(int(y), 0), n - 1)
+
+
+def tile_bounds(zoom: int, x: int, y: int):
+    """Границы тайла: (south, west, north, east)"""
+    n = 1 << zoom
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def find_nearest(query, lat: float, lng: float, k: int, category=None):
+    """
+    k ближайших провайдеров из query (и категории category): список (distance_m, id),
+    отсортированный по расстоянию.
+
+    Кандидатов берем из пространственного индекса в расширяющемся прямоугольнике,
+    лучшие k отбираем ограниченной кучей. Результат окончательный, когда k-й кандидат
+    лежит внутри круга, вписанного в прямоугольник.
+    """
+    columns = query.with_entities(ServiceProvider.id, ServiceProvider.latitude, ServiceProvider.longitude)
+    radius = NEAREST_START_RADIUS_M
+    while True:
+        south, west, north, east = bbox_around(lat, lng, radius)
+        rows = filter_in_bbox(columns, south, west, north, east, category).all()
+        nearest = heapq.nsmallest(
+            k, ((haversine_m(lat, lng, p_lat, p_lng), p_id) for p_id, p_lat, p_lng in rows)
+        )
+        whole_world = south <= -90 and north >= 90 and west <= -180 and east >= 180
+        if whole_world or (len(nearest) == k and nearest[-1][0] <= radius):
+            return nearest
+        radius *= NEAREST_GROWTH
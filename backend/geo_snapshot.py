@@ -0,0 +1,267 @@
+"""
+Колоночный снимок активных провайдеров в памяти (NumPy) для гео-запросов.
+
+Включается переменной окружения GEO_ENGINE=numpy. Снимок хранит только id,
+координаты и коды категорий, поэтому фильтры по радиусу, прямоугольнику и поиск
+ближайших считаются одним векторным проходом, без ORM-объектов. После записей
+endpoints вызывают apply(), который патчит снимок без перечитывания таблицы.
+"""
+import logging
+import os
+import threading
+
+from sqlalchemy import select
+
+from models import ServiceProvider
+from geo import EARTH_RADIUS_M
+
+try:
+    import numpy as np
+except ImportError:  # numpy - необязательная зависимость
+    np = None
+
+logger = logging.getLogger(__name__)
+
+GEO_ENGINE = os.environ.get("GEO_ENGINE", "sql").lower()
+
+
+class SnapshotData:
+    """Неизменяемая версия снимка: запрос работает с одной копией от начала до конца"""
+
+    def __init__(self, ids, lats, lngs, cats, category_codes):
+        self.ids = ids
+        self.lats = lats
+        self.lngs = lngs
+        self.cats = cats
+        self.category_codes = category_codes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _select(self, mask_fn, category):
+        mask = mask_fn(self.lats, self.lngs)
+        if category:
+            code = self.category_codes.get(category)
+            if code is None:
+                return self.ids[:0], self.lats[:0], self.lngs[:0]
+            mask &= self.cats == code
+        return self.ids[mask], self.lats[mask], self.lngs[mask]
+
+    @staticmethod
+    def _radius_mask(lat: float, lng: float, radius: float):
+        return lambda lats, lngs: (lats - lat) ** 2 + (lngs - lng) ** 2 <= radius * radius
+
+    @staticmethod
+    def _bbox_mask(south: float, west: float, north: float, east: float):
+        return lambda lats, lngs: (lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)
+
+    def radius_ids(self, lat: float, lng: float, radius: float, category=None):
+        """id в радиусе (евклидово расстояние в градусах, как в get_providers), по возрастанию"""
+        ids, _, _ = self._select(self._radius_mask(lat, lng, radius), category)
+        return np.sort(ids)
+
+    def bbox_ids(self, south: float, west: float, north: float, east: float, category=None):
+        """id внутри прямоугольника, по возрастанию"""
+        ids, _, _ = self._select(self._bbox_mask(south, west, north, east), category)
+        return np.sort(ids)
+
+    def category_counts(self, bbox=None, circle=None) -> dict:
+        """Количество провайдеров по категориям в bbox (south, west, north, east) или circle (lat, lng, radius)"""
+        cats = self.cats
+        if bbox is not None:
+            cats = cats[self._bbox_mask(*bbox)(self.lats, self.lngs)]
+        elif circle is not None:
+            cats = cats[self._radius_mask(*circle)(self.lats, self.lngs)]
+        counts = np.bincount(cats, minlength=len(self.category_codes))
+        return {
+            category: int(counts[code])
+            for category, code in self.category_codes.items()
+            if code < len(counts) and counts[code]
+        }
+
+    def nearest(self, lat: float, lng: float, k: int, category=None):
+        """k ближайших по haversine: список (distance_m, id), отсортированный по расстоянию"""
+        ids, lats, lngs = self._select(lambda lats, lngs: np.ones(len(lats), dtype=bool), category)
+        if not len(ids):
+            return []
+        phi1 = np.radians(lat)
+        phi2 = np.radians(lats)
+        a = (
+            np.sin((phi2 - phi1) / 2) ** 2
+            + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lngs - lng) / 2) ** 2
+        )
+        distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        if k < len(ids):
+            top = np.argpartition(distances, k)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.lexsort((ids[top], distances[top]))]
+        return [(float(distances[i]), int(ids[i])) for i in top]
+
+
+def _category_code(category_codes: dict, category: str) -> int:
+    code = category_codes.get(category)
+    if code is None:
+        code = len(category_codes)
+        category_codes[category] = code
+    return code
+
+
+class ProviderSnapshot:
+    """
+    Текущий SnapshotData. Запись заменяет его новым объектом, поэтому читатели
+    не блокируются. Счетчик поколений растет при каждом invalidate/apply: снимок,
+    прочитанный из БД параллельно с записью, не устанавливается (запись в нем может
+    отсутствовать, а apply уже пропущен).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._positions = {}
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and GEO_ENGINE == "numpy"
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def __len__(self):
+        data = self._data
+        return 0 if data is None else len(data)
+
+    def load(self, rows, generation=None) -> SnapshotData:
+        """
+        Строит снимок из последовательности (id, latitude, longitude, category).
+        generation - поколение на момент начала чтения rows: если с тех пор снимок
+        менялся, результат возвращается, но не устанавливается.
+        """
+        category_codes = {}
+        ids, lats, lngs, cats = [], [], [], []
+        for provider_id, lat, lng, category in rows:
+            ids.append(provider_id)
+            lats.append(lat)
+            lngs.append(lng)
+            cats.append(_category_code(category_codes, category))
+        data = SnapshotData(
+            np.array(ids, dtype=np.int64),
+            np.array(lats, dtype=np.float64),
+            np.array(lngs, dtype=np.float64),
+            np.array(cats, dtype=np.int32),
+            category_codes,
+        )
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                logger.info("Provider snapshot changed while loading, not installing")
+                return data
+            self._data = data
+            self._positions = {provider_id: i for i, provider_id in enumerate(ids)}
+        logger.info(f"Provider snapshot loaded: {len(ids)} providers")
+        return data
+
+    def rebuild(self, db) -> SnapshotData:
+        """Перечитывает активных провайдеров из БД"""
+        with self._lock:
+            generation = self._generation
+        rows = db.execute(
+            select(
+                ServiceProvider.id,
+                ServiceProvider.latitude,
+                ServiceProvider.longitude,
+                ServiceProvider.category,
+            ).where(ServiceProvider.is_active == True)
+        ).all()
+        return self.load(rows, generation)
+
+    def ensure_loaded(self, db) -> SnapshotData:
+        """Снимок для запроса; все выборки запроса нужно делать по нему"""
+        data = self._data
+        if data is None:
+            data = self.rebuild(db)
+        return data
+
+    def invalidate(self):
+        """Сбрасывает снимок: он будет перечитан при следующем запросе"""
+        with self._lock:
+            self._generation += 1
+            self._data = None
+            self._positions = {}
+
+    def apply(self, changes):
+        """
+        Патчит снимок по списку изменений (before, after) из ProviderPoint или None.
+        Массивы копируются один раз на пакет, поэтому читатели не блокируются.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            if self._data is None:
+                return
+            data = self._data
+            ids, lats, lngs, cats = (array.copy() for array in (data.ids, data.lats, data.lngs, data.cats))
+            category_codes = dict(data.category_codes)
+            positions = self._positions
+            size = len(ids)
+            appended = []
+            # Для снимка важно только последнее состояние каждого провайдера в пакете
+            latest = {}
+            for before, after in changes:
+                latest[(after or before).id] = after
+            for provider_id, after in latest.items():
+                position = positions.get(provider_id)
+                if after is not None and after.is_active:
+                    if position is not None:
+                        lats[position] = after.latitude
+                        lngs[position] = after.longitude
+                        cats[position] = _category_code(category_codes, after.category)
+                    else:
+                        appended.append(after)
+                elif position is not None:
+                    # Удаление: переносим последнюю строку на место удаляемой
+                    last = size - 1
+                    ids[position] = ids[last]
+                    lats[position] = lats[last]
+                    lngs[position] = lngs[last]
+                    cats[position] = cats[last]
+                    positions[int(ids[position])] = position
+                    del positions[provider_id]
+                    size = last
+            ids, lats, lngs, cats = ids[:size], lats[:size], lngs[:size], cats[:size]
+            if appended:
+                for offset, point in enumerate(appended):
+                    positions[point.id] = size + offset
+                ids = np.concatenate([ids, np.array([p.id for p in appended], dtype=np.int64)])
+                lats = np.concatenate([lats, np.array([p.latitude for p in appended], dtype=np.float64)])
+                lngs = np.concatenate([lngs, np.array([p.longitude for p in appended], dtype=np.float64)])
+                cats = np.concatenate([cats, np.array(
+                    [_category_code(category_codes, p.category) for p in appended], dtype=np.int32
+                )])
+            self._data = SnapshotData(ids, lats, lngs, cats, category_codes)
+
+
+provider_snapshot = ProviderSnapshot()
+
+
+def fetch_providers(db, ids, chunk_size: int = 500, columns=None):
+    """
+    Загружает активных провайдеров по списку id, сохраняя порядок списка.
+    columns - только эти колонки (должны включать id) вместо ORM-объектов.
+    """
+    ids = [int(provider_id) for provider_id in ids]
+    entities = columns or [ServiceProvider]
+    by_id = {}
+    # Пакетами, чтобы не упереться в лимит параметров SQLite
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        for provider in db.query(*entities).filter(
+            ServiceProvider.id.in_(chunk), ServiceProvider.is_active == True
+        ):
+            by_id[provider.id] = provider
+    return [by_id[provider_id] for provider_id in ids if provider_id in by_id]
+
+if GEO_ENGINE == "numpy" and np is None:
+    logger.warning("GEO_ENGINE=numpy requested but numpy is not installed, using SQL queries")
@@ -0,0 +1,34 @@
+"""
+ETag / If-None-Match для GET endpoints
+"""
+import hashlib
+
+from fastapi import Request, Response
+
+# Браузер хранит ответ, но перед использованием перепроверяет его по ETag
+CACHE_CONTROL = "no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Сильный ETag из версии данных и параметров запроса"""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Для GET сравнение слабое (RFC 9110), поэтому префикс W/ отбрасываем
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
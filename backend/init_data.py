@@ -3,6 +3,7 @@
 """
 from database import SessionLocal, engine, Base
 from models import ServiceProvider
+from data_version import commit_versioned, PROVIDERS
 
 def init_test_data():
     # Создаем таблицы, если их еще нет
@@ -569,7 +570,8 @@ def init_test_data():
     for provider in test_providers:
         db.add(provider)
     
-    db.commit()
+    # Увеличиваем версию данных, чтобы запущенные воркеры сбросили кеши
+    commit_versioned(db, PROVIDERS)
     print(f"Создано {len(test_providers)} тестовых провайдеров.")
     db.close()
 
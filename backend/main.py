@@ -1,27 +1,56 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy import func, tuple_
 from typing import List, Optional
+from pydantic import TypeAdapter
 import uvicorn
 import os
 
-from database import engine, Base, get_db
-from models import ServiceProvider, Message, User
+from database import engine, Base, get_db, SessionLocal
+from models import ServiceProvider, Message, User, Category, ProviderDeletion
 from schemas import (
-    ServiceProviderCreate, ServiceProviderUpdate, ServiceProviderResponse,
+    ServiceProviderCreate, ServiceProviderUpdate, ServiceProviderResponse, ProvidersInBBoxResponse,
+    ProviderClustersResponse, NearestProviderResponse, ProviderChangesResponse,
+    ProviderSearchResult, ProviderFacetsResponse,
     MessageCreate, MessageResponse, UserRegister, UserLogin, Token, UserResponse,
     UserUpdate, CategoryCreate, CategoryResponse
 )
 from auth import (
-    get_password_hash, authenticate_user, create_access_token,
+    get_password_hash_async, authenticate_user_async, create_access_token,
     get_current_user, get_user_by_username, get_user_by_email, ACCESS_TOKEN_EXPIRE_MINUTES,
-    get_current_admin, get_current_super_admin
+    get_current_admin, get_current_super_admin, AuthenticatedUser, invalidate_user, user_cache,
+    calibrate_bcrypt_rounds, rehash_password_if_needed
 )
 from datetime import timedelta
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import File, UploadFile, Form
 from fastapi.staticfiles import StaticFiles
-from upload import save_uploaded_file
+from fastapi.responses import StreamingResponse
+from upload import save_uploaded_file, UploadSizeLimitMiddleware
+from geo import (
+    init_spatial_index, filter_in_radius, filter_in_bbox, normalize_bbox, parse_bbox,
+    find_nearest, ProviderPoint
+)
+from geo_snapshot import provider_snapshot, fetch_providers
+from cache import TTLCache
+import data_version
+from data_version import init_data_versions, commit_versioned, get_synced_db, on_stale, current_version
+from http_cache import make_etag, etag_matches, not_modified, set_etag
+from cursors import encode_cursor, decode_cursor, decode_id_cursor, paginate_by_id, NEXT_CURSOR_HEADER
+from clusters import init_cluster_index, query_clusters
+from search import init_search_index, search_providers
+from suggest import suggest_index
+from markers import query_markers, encode_markers, MARKER_FORMATS
+from sparse_fields import parse_fields, provider_columns, fields_adapters, PROVIDER_FIELDS
+from fast_json import FAST_JSON, encode_row, encode_rows
+from exports import providers_ndjson, messages_csv
+from password_pool import password_pool_stats
+from rate_limit import login_limiter
+from starlette.concurrency import run_in_threadpool
+from bulk_import import detect_format, iter_records, import_providers, IMPORT_BATCH_SIZE
+from snapshots import snapshot_writer, schedule_snapshot_update
+from vector_tiles import get_tile, invalidate_tiles, MVT_MEDIA_TYPE
 import json
 import logging
 
@@ -42,13 +71,33 @@ logger.info(f"Python version: {os.sys.version}")
 try:
     logger.info("Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    # create_all не добавляет новые колонки и индексы в уже существующие таблицы
+    with engine.begin() as conn:
+        provider_columns_in_db = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(service_providers)")}
+        if "change_seq" not in provider_columns_in_db:
+            logger.info("Adding service_providers.change_seq...")
+            conn.exec_driver_sql("ALTER TABLE service_providers ADD COLUMN change_seq INTEGER")
+            conn.exec_driver_sql("UPDATE service_providers SET change_seq = 0")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     logger.info("Database tables created successfully")
+    init_spatial_index(engine)
+    init_cluster_index(engine)
+    init_search_index(engine)
+    init_data_versions(engine)
 except Exception as e:
     logger.error(f"Error creating database tables: {e}", exc_info=True)
     # Не прерываем запуск, если БД недоступна - приложение может работать в режиме только чтения
 
+# Подбираем стоимость bcrypt под эту машину (или берем BCRYPT_ROUNDS)
+calibrate_bcrypt_rounds()
+
 app = FastAPI(title="Service Provider Map API")
 
+# Лимит размера запросов с фото (до разбора multipart); CORS добавляется позже и оборачивает его
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -64,6 +113,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Статическая раздача файлов
@@ -80,12 +130,143 @@ except Exception as e:
     logger.error(f"Error mounting uploads directory: {e}")
 
 # ====== Категории (используются в разных endpoints) ======
-CATEGORIES = [
+# Хранятся в таблице categories; CATEGORIES - локальная копия процесса,
+# перечитывается при изменении версии данных "categories"
+DEFAULT_CATEGORIES = [
     {"value": "cargo", "label": "Грузовые машины"},
     {"value": "plumber", "label": "Сантехники"},
     {"value": "tow_truck", "label": "Эвакуаторы"},
     {"value": "electrician", "label": "Электрики"},
 ]
+CATEGORIES = [dict(cat) for cat in DEFAULT_CATEGORIES]
+
+
+def _load_categories(db: Session):
+    """Перечитывает CATEGORIES из БД"""
+    CATEGORIES[:] = [
+        {"value": cat.value, "label": cat.label}
+        for cat in db.query(Category).order_by(Category.id)
+    ]
+    suggest_index.set_categories(CATEGORIES)
+
+
+def _seed_categories():
+    """Заполняет таблицу categories значениями по умолчанию, если она пуста"""
+    db = SessionLocal()
+    try:
+        if db.query(Category).count() == 0:
+            for cat in DEFAULT_CATEGORIES:
+                db.add(Category(**cat))
+            commit_versioned(db, data_version.CATEGORIES)
+        _load_categories(db)
+    except Exception as e:
+        # Другой воркер мог заполнить таблицу одновременно с нами
+        logger.warning(f"Skipping categories seed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+try:
+    _seed_categories()
+except Exception as e:
+    logger.error(f"Error seeding categories: {e}", exc_info=True)
+
+on_stale(data_version.CATEGORIES, _load_categories)
+
+# Максимум провайдеров в ответе для видимой области карты
+MAX_BBOX_RESULTS = 1000
+# Максимум провайдеров в поиске ближайших
+MAX_NEAREST_RESULTS = 100
+# Максимальный размер страницы для списков с курсором
+MAX_PAGE_SIZE = 1000
+# Максимум провайдеров и удалений в одной странице ленты изменений
+MAX_CHANGES_RESULTS = 1000
+# Максимум результатов полнотекстового поиска
+MAX_SEARCH_RESULTS = 100
+# Максимум подсказок для строки поиска
+MAX_SUGGESTIONS = 20
+# Максимум кластеров в ответе (защита от огромного bbox на большом зуме)
+MAX_CLUSTERS = 5000
+
+
+# ====== Кеш ответов GET /api/providers и GET /api/providers/{id} ======
+# Кешируются готовые JSON-байты, поэтому попадание не трогает БД и Pydantic.
+# Последний элемент ключа - версия данных, с которой построен ETag: ответ, собранный
+# параллельно с записью, попадает под старую версию и не отдается с новым ETag
+provider_list_cache = TTLCache(maxsize=256, ttl=60, name="provider_list")
+provider_detail_cache = TTLCache(maxsize=4096, ttl=300, name="provider_detail")
+# Маркеры всей карты по (category, format, версия данных); выдача по bbox не кешируется
+markers_cache = TTLCache(maxsize=64, ttl=300, name="markers")
+_provider_adapter = TypeAdapter(ServiceProviderResponse)
+_provider_list_adapter = TypeAdapter(List[ServiceProviderResponse])
+
+# Точность округления координат и радиуса в ключе кеша (~11 м)
+CACHE_COORD_DIGITS = 4
+
+
+def _provider_list_key(category, lat, lng, radius, after_id, limit, fields=None):
+    """
+    Нормализованный ключ списка: (category, lat, lng, radius, after_id, limit, fields),
+    без радиуса координаты равны None
+    """
+    if lat and lng and radius:
+        return (
+            category or None,
+            round(lat, CACHE_COORD_DIGITS),
+            round(lng, CACHE_COORD_DIGITS),
+            round(radius, CACHE_COORD_DIGITS),
+            after_id,
+            limit,
+            fields,
+        )
+    return (category or None, None, None, None, after_id, limit, fields)
+
+
+def _list_key_matches(key, point) -> bool:
+    """Попадает ли провайдер в состоянии point в список с ключом key (без учета страницы)"""
+    category, lat, lng, radius = key[:4]
+    if point is None or not point.is_active:
+        return False
+    if category and point.category != category:
+        return False
+    if radius is None:
+        return True
+    return (point.latitude - lat) ** 2 + (point.longitude - lng) ** 2 <= radius * radius
+
+
+def _reset_provider_caches(db: Session):
+    """Сбрасывает все локальные данные о провайдерах (их изменил другой воркер)"""
+    provider_list_cache.clear()
+    provider_detail_cache.clear()
+    markers_cache.clear()
+    provider_snapshot.invalidate()
+    suggest_index.invalidate()
+
+
+on_stale(data_version.PROVIDERS, _reset_provider_caches)
+
+
+def _providers_changed(changes):
+    """
+    Обновляет локальные индексы и кеши процесса после коммита изменений провайдеров.
+    changes - список пар (before, after) из ProviderPoint; None для созданных/удаленных.
+    """
+    provider_snapshot.apply(changes)
+    suggest_index.apply(changes)
+    schedule_snapshot_update(changes)
+    invalidate_tiles(changes)
+    changed_ids = {(after or before).id for before, after in changes}
+    provider_detail_cache.invalidate(lambda key: key[0] in changed_ids)
+    changed_categories = {point.category for change in changes for point in change if point}
+    markers_cache.invalidate(lambda key: key[0] is None or key[0] in changed_categories)
+    # Списки сбрасываем только те, в которые провайдер входил или теперь входит
+    provider_list_cache.invalidate(
+        lambda key: any(
+            _list_key_matches(key, before) or _list_key_matches(key, after)
+            for before, after in changes
+        )
+    )
 
 
 @app.get("/")
@@ -123,39 +304,372 @@ def health_check(db: Session = Depends(get_db)):
 
 @app.get("/api/providers", response_model=List[ServiceProviderResponse])
 def get_providers(
+    request: Request,
     category: Optional[str] = None,
     lat: Optional[float] = None,
     lng: Optional[float] = None,
     radius: Optional[float] = None,
-    db: Session = Depends(get_db)
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_synced_db)
 ):
-    """Получить список всех провайдеров услуг"""
-    providers = db.query(ServiceProvider).filter(ServiceProvider.is_active == True)
+    """
+    Получить список всех провайдеров услуг.
+    С limit выдача постраничная: курсор следующей страницы в заголовке X-Next-Cursor.
+    fields - только перечисленные поля через запятую (id есть всегда).
+    """
+    after_id = decode_id_cursor(cursor) if cursor else None
+    fields = parse_fields(fields)
+    key = _provider_list_key(category, lat, lng, radius, after_id, limit, fields)
+    version = current_version(data_version.PROVIDERS)
+    etag = make_etag("providers", version, key)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    cache_key = key + (version,)
+    cached = provider_list_cache.get(cache_key)
+    if cached is None:
+        providers, next_cursor = _query_providers(db, *key)
+        if FAST_JSON:
+            content = encode_rows(providers, fields or PROVIDER_FIELDS)
+        else:
+            adapter = fields_adapters(fields)[1] if fields else _provider_list_adapter
+            content = adapter.dump_json(adapter.validate_python(providers, from_attributes=True))
+        cached = (content, next_cursor)
+        provider_list_cache.set(cache_key, cached)
+    content, next_cursor = cached
+    response = Response(content=content, media_type="application/json")
+    set_etag(response, etag)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def _query_providers(db: Session, category, lat, lng, radius, after_id, limit, fields=None):
+    """
+    Активные провайдеры категории и радиуса (lat/lng/radius равны None - без радиуса)
+    по возрастанию id, начиная после after_id: (providers, next_cursor).
+    С fields (или FAST_JSON) вместо ORM-объектов возвращаются строки только с этими колонками.
+    """
+    columns = provider_columns(fields or PROVIDER_FIELDS) if fields or FAST_JSON else None
+    if radius is not None and provider_snapshot.enabled:
+        # Векторный фильтр по снимку в памяти вместо SQL
+        ids = provider_snapshot.ensure_loaded(db).radius_ids(lat, lng, radius, category)
+        if after_id is not None:
+            ids = ids[ids > after_id]
+        if limit is None or len(ids) <= limit:
+            return fetch_providers(db, ids, columns=columns), None
+        ids = ids[:limit]
+        return fetch_providers(db, ids, columns=columns), encode_cursor({"id": int(ids[-1])})
+    
+    providers = db.query(*(columns or [ServiceProvider])).filter(ServiceProvider.is_active == True)
     
-    if category:
+    # Фильтрация по радиусу (если указаны координаты) через пространственный индекс
+    if radius is not None:
+        providers = filter_in_radius(providers, lat, lng, radius, category)
+    elif category:
         providers = providers.filter(ServiceProvider.category == category)
     
-    providers = providers.all()
+    if after_id is not None:
+        providers = providers.filter(ServiceProvider.id > after_id)
+    return paginate_by_id(providers, ServiceProvider.id, None, limit)
+
+
+@app.get("/api/providers/in-bbox", response_model=ProvidersInBBoxResponse)
+def get_providers_in_bbox(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    category: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_BBOX_RESULTS),
+    db: Session = Depends(get_synced_db)
+):
+    """Получить провайдеров в видимой области карты (не больше limit)"""
+    south, west, north, east = normalize_bbox(south, west, north, east)
+    if provider_snapshot.enabled:
+        ids = provider_snapshot.ensure_loaded(db).bbox_ids(south, west, north, east, category)
+        rows = fetch_providers(db, ids[:limit + 1])
+    else:
+        providers = db.query(ServiceProvider).filter(ServiceProvider.is_active == True)
+        providers = filter_in_bbox(providers, south, west, north, east, category)
+        # Берем на одну строку больше, чтобы понять, была ли выдача обрезана
+        rows = providers.order_by(ServiceProvider.id).limit(limit + 1).all()
+    return {
+        "providers": rows[:limit],
+        "truncated": len(rows) > limit,
+        "limit": limit,
+    }
+
+
+@app.get("/api/providers/clusters", response_model=ProviderClustersResponse)
+def get_provider_clusters(
+    bbox: str,
+    zoom: int = Query(..., ge=0),
+    category: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Получить кластеры провайдеров (центроид и количество) для области карты и зума"""
+    south, west, north, east = parse_bbox(bbox)
+    zoom, clusters, truncated = query_clusters(
+        db, south, west, north, east, zoom, category=category, limit=MAX_CLUSTERS
+    )
+    return {"zoom": zoom, "clusters": clusters, "truncated": truncated}
+
+
+@app.get("/api/providers/nearest", response_model=List[NearestProviderResponse])
+def get_nearest_providers(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=MAX_NEAREST_RESULTS),
+    category: Optional[str] = None,
+    db: Session = Depends(get_synced_db)
+):
+    """Получить k ближайших активных провайдеров, отсортированных по расстоянию"""
+    if provider_snapshot.enabled:
+        nearest = provider_snapshot.ensure_loaded(db).nearest(lat, lng, k, category)
+    else:
+        providers = db.query(ServiceProvider).filter(ServiceProvider.is_active == True)
+        # Категория - через find_nearest, чтобы запрос вел R*Tree, а не индекс категории
+        nearest = find_nearest(providers, lat, lng, k, category)
+    by_id = {
+        provider.id: provider
+        for provider in db.query(ServiceProvider).filter(
+            ServiceProvider.id.in_([provider_id for _, provider_id in nearest])
+        )
+    }
+    return [
+        NearestProviderResponse(
+            **ServiceProviderResponse.model_validate(by_id[provider_id]).model_dump(),
+            distance_m=distance,
+        )
+        for distance, provider_id in nearest
+        if provider_id in by_id
+    ]
+
+
+@app.get("/api/providers/search", response_model=List[ProviderSearchResult])
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    category: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    db: Session = Depends(get_db)
+):
+    """
+    Полнотекстовый поиск по названию, описанию и адресу с ранжированием BM25.
+    Если переданы lat/lng, ближние провайдеры поднимаются выше.
+    """
+    results = search_providers(db, q, category=category, lat=lat, lng=lng, limit=limit)
+    by_id = {provider.id: provider for provider in fetch_providers(db, [r[1] for r in results])}
+    return [
+        ProviderSearchResult(
+            **ServiceProviderResponse.model_validate(by_id[provider_id]).model_dump(),
+            score=score,
+            distance_m=distance,
+        )
+        for score, provider_id, distance in results
+        if provider_id in by_id
+    ]
+
+
+@app.get("/api/providers/suggest")
+def suggest(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+    db: Session = Depends(get_synced_db)
+):
+    """Подсказки для строки поиска: категории и названия провайдеров по префиксу"""
+    suggest_index.ensure_loaded(db, CATEGORIES)
+    return {"suggestions": suggest_index.suggest(prefix, limit)}
+
+
+@app.get("/api/providers/facets", response_model=ProviderFacetsResponse)
+def get_provider_facets(
+    bbox: Optional[str] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius: Optional[float] = None,
+    db: Session = Depends(get_synced_db)
+):
+    """
+    Количество активных провайдеров по категориям в области карты (bbox)
+    или в радиусе (как в /api/providers); без параметров - по всей карте
+    """
+    area = parse_bbox(bbox) if bbox else None
+    circle = (lat, lng, radius) if lat is not None and lng is not None and radius else None
     
-    # Фильтрация по радиусу (если указаны координаты)
-    if lat and lng and radius:
-        filtered_providers = []
-        for provider in providers:
-            distance = ((provider.latitude - lat) ** 2 + (provider.longitude - lng) ** 2) ** 0.5
-            if distance <= radius:
-                filtered_providers.append(provider)
-        providers = filtered_providers
+    if provider_snapshot.enabled:
+        counts = provider_snapshot.ensure_loaded(db).category_counts(bbox=area, circle=circle)
+    else:
+        query = db.query(ServiceProvider.category, func.count(ServiceProvider.id)).filter(
+            ServiceProvider.is_active == True
+        )
+        if area:
+            query = filter_in_bbox(query, *area)
+        elif circle:
+            query = filter_in_radius(query, *circle)
+        counts = dict(query.group_by(ServiceProvider.category).all())
+    
+    facets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return {
+        "facets": [{"category": category, "count": count} for category, count in facets],
+        "total": sum(counts.values()),
+    }
+
+
+@app.get("/api/providers/markers")
+def get_provider_markers(
+    request: Request,
+    category: Optional[str] = None,
+    bbox: Optional[str] = None,
+    fmt: str = Query("json", alias="format", pattern="^(" + "|".join(MARKER_FORMATS) + ")$"),
+    db: Session = Depends(get_synced_db)
+):
+    """
+    Маркеры карты в колоночном формате (id, lat, lng, код категории) без ORM и Pydantic.
+    format: json, msgpack или binary (упакованные int32/float32, см. markers.py)
+    """
+    area = parse_bbox(bbox) if bbox else None
+    version = current_version(data_version.PROVIDERS)
+    etag = make_etag("markers", version, category, area, fmt)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    key = (category or None, fmt, version)
+    cached = markers_cache.get(key) if area is None else None
+    if cached is None:
+        cached = encode_markers(query_markers(db, category, area), fmt)
+        if area is None:
+            markers_cache.set(key, cached)
+    content, media_type = cached
+    response = Response(content=content, media_type=media_type)
+    set_etag(response, etag)
+    return response
+
+
+@app.get("/api/providers/changes", response_model=ProviderChangesResponse)
+def get_provider_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_CHANGES_RESULTS),
+    db: Session = Depends(get_db)
+):
+    """
+    Получить провайдеров, созданных/измененных/деактивированных после курсора since,
+    и id безвозвратно удаленных. Без since возвращает все данные для первой синхронизации.
+    """
+    if since:
+        cursor = decode_cursor(since)
+        try:
+            last_seq = int(cursor["s"])
+            last_id = int(cursor["id"])
+            last_deletion_id = int(cursor["d"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        deletions = (
+            db.query(ProviderDeletion)
+            .filter(ProviderDeletion.id > last_deletion_id)
+            .order_by(ProviderDeletion.id)
+            .limit(limit + 1)
+            .all()
+        )
+    else:
+        # При первой синхронизации удаления не нужны: начинаем с текущего конца журнала.
+        # Журнал читаем до провайдеров, чтобы не пропустить удаление между запросами
+        last_seq, last_id = None, 0
+        last_deletion_id = db.query(func.coalesce(func.max(ProviderDeletion.id), 0)).scalar()
+        deletions = []
+    
+    # Порядок по change_seq, а не updated_at: номер присваивается под блокировкой записи,
+    # поэтому транзакция, закоммиченная позже, не может получить номер меньше уже выданного
+    providers = db.query(ServiceProvider)
+    if last_seq is not None:
+        providers = providers.filter(
+            tuple_(ServiceProvider.change_seq, ServiceProvider.id) > tuple_(last_seq, last_id)
+        )
+    providers = providers.order_by(ServiceProvider.change_seq, ServiceProvider.id).limit(limit + 1).all()
     
-    return providers
+    has_more = len(providers) > limit or len(deletions) > limit
+    providers = providers[:limit]
+    deletions = deletions[:limit]
+    if providers:
+        last_seq, last_id = providers[-1].change_seq, providers[-1].id
+    if deletions:
+        last_deletion_id = deletions[-1].id
+    
+    next_cursor = encode_cursor({
+        "s": last_seq or 0,
+        "id": last_id,
+        "d": last_deletion_id,
+    })
+    return {
+        "providers": providers,
+        "deleted": [deletion.provider_id for deletion in deletions],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+    }
+
+
+@app.get("/api/tiles/{z}/{x}/{y}.mvt")
+def get_vector_tile(
+    z: int,
+    x: int,
+    y: int,
+    category: Optional[str] = None,
+    db: Session = Depends(get_synced_db)
+):
+    """Векторный тайл (MVT) с маркерами активных провайдеров, слой providers"""
+    # Тайлы кешируются на диске по категории, поэтому произвольные значения не принимаем
+    if category and category not in {cat["value"] for cat in CATEGORIES}:
+        raise HTTPException(status_code=400, detail="Unknown category")
+    content = get_tile(db, z, x, y, category)
+    # Тайлы кешируются браузером ненадолго: после записи провайдера они меняются
+    return Response(content=content, media_type=MVT_MEDIA_TYPE, headers={"Cache-Control": "public, max-age=60"})
 
 
 @app.get("/api/providers/{provider_id}", response_model=ServiceProviderResponse)
-def get_provider(provider_id: int, db: Session = Depends(get_db)):
-    """Получить информацию о конкретном провайдере"""
-    provider = db.query(ServiceProvider).filter(ServiceProvider.id == provider_id).first()
-    if not provider:
-        raise HTTPException(status_code=404, detail="Provider not found")
-    return provider
+def get_provider(
+    provider_id: int,
+    request: Request,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_synced_db)
+):
+    """Получить информацию о конкретном провайдере (fields - только перечисленные поля)"""
+    return _provider_detail_response(db, request, provider_id, parse_fields(fields))
+
+
+def _provider_detail_response(db: Session, request: Request, provider_id: int, fields=None):
+    """Ответ с провайдером из кеша, с ETag; 304, если клиент уже имеет эту версию"""
+    key = (provider_id, fields)
+    version = current_version(data_version.PROVIDERS)
+    etag = make_etag("provider", version, key)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    cache_key = key + (version,)
+    content = provider_detail_cache.get(cache_key)
+    if content is None:
+        if FAST_JSON:
+            entities = provider_columns(fields or PROVIDER_FIELDS)
+        elif fields:
+            entities = provider_columns(fields)
+            adapter = fields_adapters(fields)[0]
+        else:
+            entities = [ServiceProvider]
+            adapter = _provider_adapter
+        provider = db.query(*entities).filter(ServiceProvider.id == provider_id).first()
+        if not provider:
+            raise HTTPException(status_code=404, detail="Provider not found")
+        if FAST_JSON:
+            content = encode_row(provider, fields or PROVIDER_FIELDS)
+        else:
+            content = adapter.dump_json(adapter.validate_python(provider, from_attributes=True))
+        provider_detail_cache.set(cache_key, content)
+    response = Response(content=content, media_type="application/json")
+    set_etag(response, etag)
+    return response
 
 
 @app.post("/api/providers", response_model=ServiceProviderResponse)
@@ -163,8 +677,9 @@ def create_provider(provider: ServiceProviderCreate, db: Session = Depends(get_d
     """Создать нового провайдера услуг"""
     db_provider = ServiceProvider(**provider.dict())
     db.add(db_provider)
-    db.commit()
+    commit_versioned(db, data_version.PROVIDERS)
     db.refresh(db_provider)
+    _providers_changed([(None, ProviderPoint.of(db_provider))])
     return db_provider
 
 
@@ -180,7 +695,7 @@ async def update_provider(
     address: Optional[str] = Form(None),
     photo: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """Обновить информацию о провайдере (только для владельца)"""
     db_provider = db.query(ServiceProvider).filter(ServiceProvider.id == provider_id).first()
@@ -191,6 +706,7 @@ async def update_provider(
     if current_user.provider_id != provider_id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
+    before = ProviderPoint.of(db_provider)
     # Обновляем поля (только если они переданы)
     if name is not None:
         db_provider.name = name
@@ -216,8 +732,9 @@ async def update_provider(
         # Сохраняем новое
         db_provider.photo = await save_uploaded_file(photo)
     
-    db.commit()
+    commit_versioned(db, data_version.PROVIDERS)
     db.refresh(db_provider)
+    _providers_changed([(before, ProviderPoint.of(db_provider))])
     return db_provider
 
 
@@ -228,15 +745,30 @@ def delete_provider(provider_id: int, db: Session = Depends(get_db)):
     if not db_provider:
         raise HTTPException(status_code=404, detail="Provider not found")
     
+    before = ProviderPoint.of(db_provider)
     db_provider.is_active = False
-    db.commit()
+    commit_versioned(db, data_version.PROVIDERS)
+    _providers_changed([(before, ProviderPoint.of(db_provider))])
     return {"message": "Provider deleted successfully"}
 
 
 @app.get("/api/providers/{provider_id}/messages", response_model=List[MessageResponse])
-def get_provider_messages(provider_id: int, db: Session = Depends(get_db)):
-    """Получить сообщения для провайдера"""
-    messages = db.query(Message).filter(Message.provider_id == provider_id).all()
+def get_provider_messages(
+    provider_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Получить сообщения для провайдера.
+    С limit выдача постраничная: курсор следующей страницы в заголовке X-Next-Cursor.
+    """
+    messages, next_cursor = paginate_by_id(
+        db.query(Message).filter(Message.provider_id == provider_id), Message.id, cursor, limit
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return messages
 
 
@@ -262,8 +794,13 @@ def create_message(
 
 
 @app.get("/api/categories")
-def get_categories():
+def get_categories(request: Request, response: Response, db: Session = Depends(get_synced_db)):
     """Получить список доступных категорий"""
+    etag = make_etag("categories", current_version(data_version.CATEGORIES))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    
     # Используем CATEGORIES из админ-панели, добавляем "other" если его нет
     categories_list = CATEGORIES.copy()
     if not any(cat["value"] == "other" for cat in categories_list):
@@ -280,6 +817,8 @@ async def upload_file(file: UploadFile = File(...)):
     try:
         file_url = await save_uploaded_file(file)
         return {"url": file_url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -312,6 +851,10 @@ async def register(
     if photo:
         photo_url = await save_uploaded_file(photo)
     
+    # Хешируем до первой записи: после flush SQLite держит блокировку записи до коммита,
+    # а хеширование вместе с очередью пула паролей может занять секунды
+    password_hash = await get_password_hash_async(password)
+    
     # Создаем провайдера
     provider_data = {
         "name": name,
@@ -331,13 +874,14 @@ async def register(
     db_user = User(
         username=username,
         email=email,
-        password_hash=get_password_hash(password),
+        password_hash=password_hash,
         provider_id=db_provider.id
     )
     db.add(db_user)
-    db.commit()
+    commit_versioned(db, data_version.PROVIDERS)
     db.refresh(db_user)
     db.refresh(db_provider)
+    _providers_changed([(None, ProviderPoint.of(db_provider))])
     
     # Создаем токен
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -355,9 +899,24 @@ async def register(
 
 
 @app.post("/api/auth/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db)
+):
     """Вход в систему"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    # Лимит попыток проверяется до запроса к БД и bcrypt
+    client_ip = request.client.host if request.client else None
+    retry_after = await run_in_threadpool(login_limiter.hit, form_data.username, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+    
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -365,6 +924,9 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    await run_in_threadpool(login_limiter.login_succeeded, form_data.username)
+    # Хеш старого формата или меньшей стоимости пересчитывается после ответа
+    background_tasks.add_task(rehash_password_if_needed, user.id, user.password_hash, form_data.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -380,44 +942,47 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 @app.get("/api/auth/me", response_model=UserResponse)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+def get_current_user_info(current_user: AuthenticatedUser = Depends(get_current_user)):
     """Получить информацию о текущем пользователе"""
     return current_user
 
 
 @app.get("/api/auth/my-provider", response_model=ServiceProviderResponse)
 def get_my_provider(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    db: Session = Depends(get_synced_db)
 ):
     """Получить информацию о провайдере текущего пользователя"""
     if not current_user.provider_id:
         raise HTTPException(status_code=404, detail="Provider not found")
     
-    provider = db.query(ServiceProvider).filter(ServiceProvider.id == current_user.provider_id).first()
-    if not provider:
-        raise HTTPException(status_code=404, detail="Provider not found")
-    
-    return provider
+    return _provider_detail_response(db, request, current_user.provider_id)
 
 
 # ====== АДМИН-ПАНЕЛЬ: Управление пользователями ======
 @app.get("/api/admin/users", response_model=List[UserResponse])
 def get_all_users(
-    current_user: User = Depends(get_current_super_admin),
+    response: Response,
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 100
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)
 ):
-    """Получить список всех пользователей (только для супер-администратора)"""
-    users = db.query(User).offset(skip).limit(limit).all()
+    """
+    Получить список всех пользователей (только для супер-администратора).
+    Курсор следующей страницы - в заголовке X-Next-Cursor.
+    """
+    users, next_cursor = paginate_by_id(db.query(User), User.id, cursor, limit)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return users
 
 
 @app.get("/api/admin/users/{user_id}", response_model=UserResponse)
 def get_user(
     user_id: int,
-    current_user: User = Depends(get_current_super_admin),
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db)
 ):
     """Получить информацию о пользователе (только для супер-администратора)"""
@@ -431,7 +996,7 @@ def get_user(
 def update_user(
     user_id: int,
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_super_admin),
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db)
 ):
     """Обновить информацию о пользователе (только для супер-администратора)"""
@@ -439,11 +1004,13 @@ def update_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    old_username = user.username
     update_data = user_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(user, field, value)
     
-    db.commit()
+    commit_versioned(db, data_version.USERS)
+    invalidate_user(old_username, user.username)
     db.refresh(user)
     return user
 
@@ -451,7 +1018,7 @@ def update_user(
 @app.delete("/api/admin/users/{user_id}")
 def delete_user(
     user_id: int,
-    current_user: User = Depends(get_current_super_admin),
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db)
 ):
     """Удалить пользователя (только для супер-администратора)"""
@@ -463,7 +1030,8 @@ def delete_user(
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
     
     db.delete(user)
-    db.commit()
+    commit_versioned(db, data_version.USERS)
+    invalidate_user(user.username)
     return {"message": "User deleted successfully"}
 
 
@@ -471,7 +1039,7 @@ def delete_user(
 @app.delete("/api/admin/providers/{provider_id}")
 def delete_provider(
     provider_id: int,
-    current_user: User = Depends(get_current_admin),
+    current_user: AuthenticatedUser = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
     """Удалить провайдера (для администраторов)"""
@@ -479,15 +1047,19 @@ def delete_provider(
     if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
     
+    before = ProviderPoint.of(provider)
     db.delete(provider)
-    db.commit()
+    # Запись в журнал удалений для ленты /api/providers/changes
+    db.add(ProviderDeletion(provider_id=provider_id))
+    commit_versioned(db, data_version.PROVIDERS)
+    _providers_changed([(before, None)])
     return {"message": "Provider deleted successfully"}
 
 
 @app.put("/api/admin/providers/{provider_id}/toggle-active", response_model=ServiceProviderResponse)
 def toggle_provider_active(
     provider_id: int,
-    current_user: User = Depends(get_current_admin),
+    current_user: AuthenticatedUser = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
     """Активировать/деактивировать провайдера (для администраторов)"""
@@ -495,17 +1067,42 @@ def toggle_provider_active(
     if not provider:
         raise HTTPException(status_code=404, detail="Provider not found")
     
+    before = ProviderPoint.of(provider)
     provider.is_active = not provider.is_active
-    db.commit()
+    commit_versioned(db, data_version.PROVIDERS)
     db.refresh(provider)
+    _providers_changed([(before, ProviderPoint.of(provider))])
     return provider
 
 
+@app.post("/api/admin/providers/bulk")
+def bulk_import_providers(
+    file: UploadFile = File(...),
+    fmt: Optional[str] = Query(None, alias="format"),
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: AuthenticatedUser = Depends(get_current_admin),
+    db: Session = Depends(get_synced_db)
+):
+    """
+    Массовый импорт провайдеров из CSV (заголовок - имена полей) или NDJSON (для администраторов).
+    Формат берется из format или расширения файла; возвращает отчет с ошибками по строкам.
+    """
+    fmt = detect_format(file.filename, fmt)
+    report = import_providers(
+        db,
+        iter_records(file.file, fmt),
+        on_batch=_providers_changed,
+        categories={cat["value"] for cat in CATEGORIES},
+        batch_size=batch_size,
+    )
+    return report.as_dict()
+
+
 # ====== АДМИН-ПАНЕЛЬ: Управление категориями ======
 @app.get("/api/admin/categories", response_model=List[CategoryResponse])
 def get_all_categories(
-    current_user: User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_admin),
+    db: Session = Depends(get_synced_db)
 ):
     """Получить список всех категорий (для администраторов)"""
     return CATEGORIES
@@ -514,33 +1111,28 @@ def get_all_categories(
 @app.post("/api/admin/categories", response_model=CategoryResponse)
 def create_category(
     category: CategoryCreate,
-    current_user: User = Depends(get_current_super_admin),
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db)
 ):
     """Создать новую категорию (только для супер-администратора)"""
     # Проверяем, не существует ли уже такая категория
-    if any(cat["value"] == category.value for cat in CATEGORIES):
+    if db.query(Category).filter(Category.value == category.value).first():
         raise HTTPException(status_code=400, detail="Category already exists")
     
-    new_category = {"value": category.value, "label": category.label}
-    CATEGORIES.append(new_category)
-    return new_category
+    db.add(Category(value=category.value, label=category.label))
+    commit_versioned(db, data_version.CATEGORIES)
+    _load_categories(db)
+    return {"value": category.value, "label": category.label}
 
 
 @app.delete("/api/admin/categories/{category_value}")
 def delete_category(
     category_value: str,
-    current_user: User = Depends(get_current_super_admin),
+    current_user: AuthenticatedUser = Depends(get_current_super_admin),
     db: Session = Depends(get_db)
 ):
     """Удалить категорию (только для супер-администратора)"""
-    global CATEGORIES
-    category_to_remove = None
-    for cat in CATEGORIES:
-        if cat["value"] == category_value:
-            category_to_remove = cat
-            break
-    
+    category_to_remove = db.query(Category).filter(Category.value == category_value).first()
     if not category_to_remove:
         raise HTTPException(status_code=404, detail="Category not found")
     
@@ -552,15 +1144,73 @@ def delete_category(
             detail=f"Cannot delete category: {providers_count} providers use this category"
         )
     
-    CATEGORIES.remove(category_to_remove)
+    db.delete(category_to_remove)
+    commit_versioned(db, data_version.CATEGORIES)
+    _load_categories(db)
     return {"message": "Category deleted successfully"}
 
 
+@app.get("/api/admin/cache/stats")
+def get_cache_stats(current_user: AuthenticatedUser = Depends(get_current_admin)):
+    """Получить счетчики попаданий/промахов кешей (для администраторов)"""
+    return {
+        "caches": [
+            provider_list_cache.stats(),
+            provider_detail_cache.stats(),
+            markers_cache.stats(),
+            user_cache.stats(),
+        ]
+    }
+
+
+@app.post("/api/admin/snapshots/rebuild")
+def rebuild_snapshots(
+    current_user: AuthenticatedUser = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Пересобрать все статические снимки в SNAPSHOT_DIR (для администраторов)"""
+    if not snapshot_writer.enabled:
+        raise HTTPException(status_code=400, detail="Static snapshots are disabled (SNAPSHOT_DIR is not set)")
+    manifest = snapshot_writer.rebuild(db)
+    return {
+        "version": manifest["version"],
+        "categories": len(manifest["categories"]),
+        "tiles": len(manifest["tiles"]),
+    }
+
+
+# ====== Выгрузки для админ-панели ======
+@app.get("/api/admin/export/providers.ndjson")
+def export_providers(current_user: AuthenticatedUser = Depends(get_current_admin)):
+    """Выгрузить всех провайдеров в NDJSON потоком (для администраторов)"""
+    return StreamingResponse(
+        providers_ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="providers.ndjson"'},
+    )
+
+
+@app.get("/api/admin/export/messages.csv")
+def export_messages(current_user: AuthenticatedUser = Depends(get_current_admin)):
+    """Выгрузить все сообщения в CSV потоком (для администраторов)"""
+    return StreamingResponse(
+        messages_csv(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="messages.csv"'},
+    )
+
+
+@app.get("/api/admin/auth/stats")
+def get_auth_stats(current_user: AuthenticatedUser = Depends(get_current_admin)):
+    """Получить нагрузку на пул проверки паролей и счетчики лимита входа (для администраторов)"""
+    return {"password_pool": password_pool_stats(), "login_limiter": login_limiter.stats()}
+
+
 # ====== Статистика для админ-панели ======
 @app.get("/api/admin/stats")
 def get_admin_stats(
-    current_user: User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_admin),
+    db: Session = Depends(get_synced_db)
 ):
     """Получить статистику для админ-панели (для администраторов)"""
     total_users = db.query(User).count()
@@ -0,0 +1,101 @@
+"""
+Компактный колоночный формат маркеров карты: только id, координаты и код категории.
+
+Форматы:
+- json: {"categories": [...], "id": [...], "lat": [...], "lng": [...], "category": [коды]}
+- msgpack: та же структура (нужен пакет msgpack)
+- binary: little-endian блок
+    b"CMK1", uint32 count, uint16 n_categories,
+    n_categories x (uint8 длина, utf-8 строка),
+    int32 id[count], float32 lat[count], float32 lng[count], uint8 category[count]
+"""
+import json
+import struct
+import sys
+from array import array
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from models import ServiceProvider
+from geo import filter_in_bbox
+
+try:
+    import msgpack
+except ImportError:  # msgpack - необязательная зависимость
+    msgpack = None
+
+MARKER_FORMATS = ("json", "msgpack", "binary")
+MARKERS_MAGIC = b"CMK1"
+
+_MEDIA_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "binary": "application/octet-stream",
+}
+
+
+def query_markers(db, category=None, bbox=None):
+    """Колонки активных провайдеров без ORM-объектов: (ids, lats, lngs, categories)"""
+    query = select(
+        ServiceProvider.id,
+        ServiceProvider.latitude,
+        ServiceProvider.longitude,
+        ServiceProvider.category,
+    ).where(ServiceProvider.is_active == True)
+    if bbox:
+        query = filter_in_bbox(query, *bbox, category=category)
+    elif category:
+        query = query.where(ServiceProvider.category == category)
+    rows = db.execute(query.order_by(ServiceProvider.id)).all()
+    if not rows:
+        return [], [], [], []
+    return tuple(map(list, zip(*rows)))
+
+
+def _columnar(ids, lats, lngs, categories) -> dict:
+    codes = {}
+    category_codes = [codes.setdefault(category, len(codes)) for category in categories]
+    return {
+        "categories": list(codes),
+        "id": ids,
+        "lat": lats,
+        "lng": lngs,
+        "category": category_codes,
+    }
+
+
+def _encode_binary(data: dict) -> bytes:
+    names = [name.encode("utf-8")[:255] for name in data["categories"]]
+    if len(names) > 255:
+        raise HTTPException(status_code=400, detail="Too many categories for binary format")
+    parts = [MARKERS_MAGIC, struct.pack("<IH", len(data["id"]), len(names))]
+    for name in names:
+        parts.append(struct.pack("<B", len(name)) + name)
+    for typecode, values in (
+        ("i", data["id"]),
+        ("f", data["lat"]),
+        ("f", data["lng"]),
+        ("B", data["category"]),
+    ):
+        column = array(typecode, values)
+        if sys.byteorder == "big":
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b"".join(parts)
+
+
+def encode_markers(columns, fmt: str):
+    """Кодирует колонки маркеров: (bytes, media_type)"""
+    data = _columnar(*columns)
+    if fmt == "json":
+        content = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    elif fmt == "msgpack":
+        if msgpack is None:
+            raise HTTPException(status_code=400, detail="msgpack format is not available")
+        content = msgpack.packb(data)
+    elif fmt == "binary":
+        content = _encode_binary(data)
+    else:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(MARKER_FORMATS)}")
+    return content, _MEDIA_TYPES[fmt]
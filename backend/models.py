@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -19,6 +19,14 @@ class User(Base):
     provider = relationship("ServiceProvider", back_populates="user", uselist=False)
 
 
+# Версия providers, которую получит текущая транзакция в commit_versioned. Выражение
+# вычисляется внутри INSERT/UPDATE, то есть уже под блокировкой записи SQLite:
+# в отличие от updated_at, номера идут в порядке коммитов
+NEXT_PROVIDERS_VERSION = text(
+    "(SELECT COALESCE(MAX(version), 0) + 1 FROM data_versions WHERE name = 'providers')"
+)
+
+
 class ServiceProvider(Base):
     __tablename__ = "service_providers"
 
@@ -35,7 +43,9 @@ class ServiceProvider(Base):
     photo = Column(String)  # URL или путь к фото
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Номер последнего изменения для ленты /api/providers/changes
+    change_seq = Column(Integer, default=NEXT_PROVIDERS_VERSION, onupdate=NEXT_PROVIDERS_VERSION, index=True)
 
     messages = relationship("Message", back_populates="provider")
     user = relationship("User", back_populates="provider", uselist=False)
@@ -45,7 +55,7 @@ class Message(Base):
     __tablename__ = "messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    provider_id = Column(Integer, ForeignKey("service_providers.id"), nullable=False)
+    provider_id = Column(Integer, ForeignKey("service_providers.id"), nullable=False, index=True)
     client_name = Column(String, nullable=False)
     client_phone = Column(String, nullable=False)
     client_email = Column(String)
@@ -54,3 +64,51 @@ class Message(Base):
 
     provider = relationship("ServiceProvider", back_populates="messages")
 
+
+
+class ProviderCluster(Base):
+    """Предрасчитанные кластеры активных провайдеров (поддерживаются триггерами, см. clusters.py)"""
+    __tablename__ = "provider_clusters"
+
+    zoom = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum_lat = Column(Float, nullable=False, default=0)
+    sum_lng = Column(Float, nullable=False, default=0)
+
+
+class Category(Base):
+    __tablename__ = "categories"
+
+    id = Column(Integer, primary_key=True, index=True)
+    value = Column(String, unique=True, nullable=False, index=True)
+    label = Column(String, nullable=False)
+
+
+class DataVersion(Base):
+    """Счетчик версии данных; увеличивается в той же транзакции, что и запись (см. data_version.py)"""
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)  # providers, categories, users
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ProviderDeletion(Base):
+    """Журнал жестких удалений провайдеров (для ленты изменений)"""
+    __tablename__ = "provider_deletions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RateLimitCounter(Base):
+    """Счетчики скользящего окна лимитера входа в режиме RATE_LIMIT_BACKEND=sqlite (см. rate_limit.py)"""
+    __tablename__ = "rate_limit_counters"
+
+    key = Column(String, primary_key=True)  # например, "user:admin" или "ip:10.0.0.1"
+    window_index = Column(Integer, nullable=False)  # номер текущего окна
+    prev_count = Column(Integer, nullable=False, default=0)
+    curr_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,71 @@
+"""
+Отдельный ограниченный пул потоков для bcrypt.
+
+Хеширование и проверка пароля занимают сотни миллисекунд CPU. В пуле фиксированного
+размера поток перебора паролей нагружает только этот пул, а не event loop и общий
+threadpool, в котором работают чтения карты. Очередь тоже ограничена: при
+переполнении запрос сразу получает 503 вместо бесконечного ожидания.
+bcrypt освобождает GIL, поэтому потоков достаточно.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+PASSWORD_POOL_SIZE = int(os.getenv("PASSWORD_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# Сколько задач может ждать в очереди сверх работающих
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_SIZE, thread_name_prefix="password")
+_lock = threading.Lock()
+_stats = {
+    "pending": 0, "running": 0, "completed": 0, "cancelled": 0, "rejected": 0, "max_queue_depth": 0,
+}
+
+
+def _run(fn, args, started):
+    with _lock:
+        _stats["running"] += 1
+        started.append(True)
+    return fn(*args)
+
+
+def _done(future, started):
+    # Вызывается и для выполненных, и для отмененных в очереди задач (тогда _run не запускался)
+    with _lock:
+        _stats["pending"] -= 1
+        if started:
+            _stats["running"] -= 1
+            _stats["completed"] += 1
+        else:
+            _stats["cancelled"] += 1
+
+
+async def run_password_task(fn, *args):
+    """Выполняет fn(*args) в пуле паролей и ждет результат, не блокируя event loop"""
+    with _lock:
+        queue_depth = _stats["pending"] - _stats["running"]
+        if queue_depth >= PASSWORD_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many authentication requests, try again later",
+                headers={"Retry-After": "1"},
+            )
+        _stats["pending"] += 1
+        _stats["max_queue_depth"] = max(_stats["max_queue_depth"], queue_depth + 1)
+    started = []
+    future = _executor.submit(_run, fn, args, started)
+    future.add_done_callback(lambda done: _done(done, started))
+    return await asyncio.wrap_future(future)
+
+
+def password_pool_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = stats["pending"] - stats["running"]
+    stats["workers"] = PASSWORD_POOL_SIZE
+    stats["queue_limit"] = PASSWORD_QUEUE_LIMIT
+    return stats
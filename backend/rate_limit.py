@@ -0,0 +1,174 @@
+"""
+Ограничение частоты попыток входа: скользящее окно по username и по IP.
+
+Счетчик скользящего окна хранит на ключ всего два числа - попытки в текущем и в
+предыдущем окне; оценка числа попыток за последние window секунд:
+    prev_count * (доля предыдущего окна, попадающая в интервал) + curr_count.
+Проверка выполняется до запроса к БД и bcrypt, поэтому перебор паролей упирается
+в лимит, а не в CPU.
+
+RATE_LIMIT_BACKEND=memory (по умолчанию) - счетчики в памяти процесса (LRU);
+RATE_LIMIT_BACKEND=sqlite - общая для всех воркеров таблица rate_limit_counters.
+IP берется из request.client: за прокси uvicorn нужно запускать с --proxy-headers и
+--forwarded-allow-ips (Procfile и railway.json доверяют любому адресу, потому что на
+Railway приложение доступно только через прокси), иначе все клиенты делят один ключ IP.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import case, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import engine
+from models import RateLimitCounter
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+LOGIN_WINDOW_SECONDS = int(os.getenv("LOGIN_WINDOW_SECONDS", "300"))
+LOGIN_MAX_PER_USERNAME = int(os.getenv("LOGIN_MAX_PER_USERNAME", "10"))
+LOGIN_MAX_PER_IP = int(os.getenv("LOGIN_MAX_PER_IP", "50"))
+# Сколько ключей держать в памяти (самые давние вытесняются)
+MEMORY_MAX_KEYS = 100_000
+# Раз в столько попыток из таблицы удаляются счетчики, которые уже ни на что не влияют
+SQLITE_PURGE_EVERY = 1000
+
+
+class MemoryWindowStore:
+    def __init__(self, maxsize: int = MEMORY_MAX_KEYS):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> [window, prev_count, curr_count]
+
+    def hit(self, key: str, window: int):
+        """Засчитывает попытку в окне window: (prev_count, curr_count) после нее"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = [window, 0, 0]
+                self._data[key] = entry
+                if len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            else:
+                self._data.move_to_end(key)
+            if entry[0] != window:
+                entry[1] = entry[2] if entry[0] == window - 1 else 0
+                entry[2] = 0
+                entry[0] = window
+            entry[2] += 1
+            return entry[1], entry[2]
+
+    def reset(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class SQLiteWindowStore:
+    """Те же счетчики в таблице: один атомарный UPSERT ... RETURNING на попытку"""
+
+    def __init__(self):
+        self._hits = 0
+
+    def hit(self, key: str, window: int):
+        table = RateLimitCounter.__table__
+        statement = sqlite_insert(table).values(key=key, window_index=window, prev_count=0, curr_count=1)
+        # Справа в SET - значения строки до обновления
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                "prev_count": case(
+                    (table.c.window_index == window, table.c.prev_count),
+                    (table.c.window_index == window - 1, table.c.curr_count),
+                    else_=0,
+                ),
+                "curr_count": case(
+                    (table.c.window_index == window, table.c.curr_count + 1),
+                    else_=1,
+                ),
+                "window_index": window,
+            },
+        )
+        self._hits += 1
+        with engine.begin() as conn:
+            prev_count, curr_count = conn.execute(
+                statement.returning(table.c.prev_count, table.c.curr_count)
+            ).one()
+            if self._hits % SQLITE_PURGE_EVERY == 0:
+                conn.execute(delete(RateLimitCounter).where(RateLimitCounter.window_index < window - 1))
+        return prev_count, curr_count
+
+    def reset(self, key: str):
+        with engine.begin() as conn:
+            conn.execute(delete(RateLimitCounter).where(RateLimitCounter.key == key))
+
+    def size(self):
+        return None
+
+
+class SlidingWindowLimiter:
+    def __init__(self, limit: int, window_seconds: int, store):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.store = store
+        self.rejected = 0
+
+    def hit(self, key: str, now: float = None) -> int:
+        """Засчитывает попытку; 0 - разрешено, иначе через сколько секунд повторить"""
+        now = time.time() if now is None else now
+        window = int(now // self.window_seconds)
+        elapsed = now / self.window_seconds - window  # доля текущего окна, от 0 до 1
+        prev_count, curr_count = self.store.hit(key, window)
+        if prev_count * (1 - elapsed) + curr_count <= self.limit:
+            return 0
+        self.rejected += 1
+        if curr_count > self.limit:
+            # Только следующее окно: текущее уже переполнено само по себе
+            wait = (1 - elapsed) * self.window_seconds
+        else:
+            # Ждем, пока вклад предыдущего окна уменьшится до свободного места
+            decay_until = 1 - (self.limit - curr_count) / prev_count
+            wait = (decay_until - elapsed) * self.window_seconds
+        return max(1, math.ceil(wait))
+
+    def reset(self, key: str):
+        self.store.reset(key)
+
+
+class LoginLimiter:
+    """Два лимита на попытку входа: по имени пользователя и по IP"""
+
+    def __init__(self, store):
+        self.by_username = SlidingWindowLimiter(LOGIN_MAX_PER_USERNAME, LOGIN_WINDOW_SECONDS, store)
+        self.by_ip = SlidingWindowLimiter(LOGIN_MAX_PER_IP, LOGIN_WINDOW_SECONDS, store)
+        self.store = store
+
+    @staticmethod
+    def _username_key(username: str) -> str:
+        return f"user:{username.casefold()}"
+
+    def hit(self, username: str, ip) -> int:
+        """Засчитывает попытку входа; 0 - разрешено, иначе Retry-After в секундах"""
+        retry_after = self.by_ip.hit(f"ip:{ip}") if ip else 0
+        return max(retry_after, self.by_username.hit(self._username_key(username)))
+
+    def login_succeeded(self, username: str):
+        """Успешный вход снимает ограничение с имени (но не с IP)"""
+        self.by_username.reset(self._username_key(username))
+
+    def stats(self) -> dict:
+        return {
+            "backend": RATE_LIMIT_BACKEND,
+            "window_seconds": LOGIN_WINDOW_SECONDS,
+            "max_per_username": LOGIN_MAX_PER_USERNAME,
+            "max_per_ip": LOGIN_MAX_PER_IP,
+            "rejected_by_username": self.by_username.rejected,
+            "rejected_by_ip": self.by_ip.rejected,
+            "tracked_keys": self.store.size(),
+        }
+
+
+login_limiter = LoginLimiter(SQLiteWindowStore() if RATE_LIMIT_BACKEND == "sqlite" else MemoryWindowStore())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 
@@ -44,6 +44,50 @@ class ServiceProviderResponse(ServiceProviderBase):
         from_attributes = True
 
 
+class ProviderChangesResponse(BaseModel):
+    providers: List[ServiceProviderResponse]  # созданные, измененные и деактивированные
+    deleted: List[int]  # id провайдеров, удаленных безвозвратно
+    next_cursor: str  # передать в since при следующей синхронизации
+    has_more: bool  # True - есть еще изменения, запросить сразу с next_cursor
+
+
+class NearestProviderResponse(ServiceProviderResponse):
+    distance_m: float  # расстояние до точки запроса в метрах
+
+
+class ProviderSearchResult(ServiceProviderResponse):
+    score: float  # релевантность (больше - лучше), с учетом расстояния, если оно задано
+    distance_m: Optional[float] = None
+
+
+class ProvidersInBBoxResponse(BaseModel):
+    providers: List[ServiceProviderResponse]
+    truncated: bool  # True, если в области больше провайдеров, чем limit
+    limit: int
+
+
+class ProviderCluster(BaseModel):
+    lat: float
+    lng: float
+    count: int
+
+
+class ProviderClustersResponse(BaseModel):
+    zoom: int  # уровень зума, по которому посчитаны кластеры
+    clusters: List[ProviderCluster]
+    truncated: bool
+
+
+class CategoryFacet(BaseModel):
+    category: str
+    count: int
+
+
+class ProviderFacetsResponse(BaseModel):
+    facets: List[CategoryFacet]  # по убыванию количества
+    total: int
+
+
 class MessageCreate(BaseModel):
     client_name: str
     client_phone: str
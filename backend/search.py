@@ -0,0 +1,166 @@
+"""
+Полнотекстовый поиск провайдеров (SQLite FTS5).
+
+Индекс service_providers_fts - external content таблица над service_providers
+(name, description, address), синхронизируется триггерами. Токенизатор trigram
+ищет подстроки без учета регистра, в том числе кириллицу ("сантехник Джал");
+если SQLite собран без него, используется unicode61 с поиском по префиксам.
+"""
+import logging
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "service_providers_fts"
+# Веса BM25 для колонок name, description, address
+BM25_WEIGHTS = (10.0, 1.0, 3.0)
+# Расстояние, на котором релевантность при смешивании с расстоянием падает вдвое
+SEARCH_DISTANCE_SCALE_KM = 5.0
+# Сколько лучших по BM25 кандидатов переранжировать с учетом расстояния
+SEARCH_RERANK_CANDIDATES = 200
+TRIGRAM_MIN_TOKEN = 3
+
+# Токенизатор выбирается в init_search_index; None - поиск недоступен
+search_tokenizer = None
+
+_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai
+    AFTER INSERT ON service_providers
+    BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, name, description, address)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad
+    AFTER DELETE ON service_providers
+    BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, description, address)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au
+    AFTER UPDATE OF name, description, address ON service_providers
+    BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, description, address)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description, OLD.address);
+        INSERT INTO {SEARCH_TABLE} (rowid, name, description, address)
+        VALUES (NEW.id, NEW.name, NEW.description, NEW.address);
+    END
+    """,
+]
+
+
+def _existing_tokenizer(conn):
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": SEARCH_TABLE},
+    ).scalar()
+    if sql is None:
+        return None
+    return "trigram" if "trigram" in sql else "unicode61"
+
+
+def init_search_index(engine) -> bool:
+    """Создает FTS5 индекс и триггеры, при первом создании заполняет его"""
+    global search_tokenizer
+    if engine.dialect.name != "sqlite":
+        logger.info("Full-text search is only available for SQLite")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            tokenizer = _existing_tokenizer(conn)
+            created = tokenizer is None
+            if created:
+                for tokenizer, options in (
+                    ("trigram", "trigram"),
+                    ("unicode61", "unicode61 remove_diacritics 2"),
+                ):
+                    try:
+                        conn.execute(text(
+                            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                            "USING fts5(name, description, address, "
+                            f"content='service_providers', content_rowid='id', tokenize='{options}')"
+                        ))
+                        break
+                    except Exception as e:
+                        logger.warning(f"FTS5 tokenizer {tokenizer} is not available: {e}")
+                else:
+                    return False
+            for ddl in _SEARCH_TRIGGERS:
+                conn.execute(text(ddl))
+            if created:
+                # Заполняем индекс для уже существующих провайдеров
+                conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"))
+    except Exception as e:
+        logger.error(f"Error creating search index: {e}", exc_info=True)
+        return False
+
+    search_tokenizer = tokenizer
+    logger.info(f"Search index is ready ({tokenizer})")
+    return True
+
+
+def build_match_query(q: str) -> str:
+    """
+    Превращает пользовательский ввод в запрос FTS5: каждое слово - отдельная фраза (AND).
+    Спецсимволы синтаксиса FTS5 внутри кавычек теряют смысл.
+    """
+    tokens = [token.replace('"', '""') for token in q.split()]
+    if search_tokenizer == "trigram":
+        # Триграммы не находят слова короче трех символов
+        tokens = [token for token in tokens if len(token) >= TRIGRAM_MIN_TOKEN]
+        phrases = [f'"{token}"' for token in tokens]
+    else:
+        phrases = [f'"{token}"*' for token in tokens]
+    if not phrases:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Search query must contain a word of at least {TRIGRAM_MIN_TOKEN} characters",
+        )
+    return " ".join(phrases)
+
+
+def search_providers(db, q: str, category=None, lat=None, lng=None, limit: int = 20):
+    """
+    Поиск активных провайдеров: список (score, id, distance_m), лучшие первыми.
+    score - релевантность BM25 (больше - лучше); при заданных lat/lng она делится
+    на (1 + расстояние / SEARCH_DISTANCE_SCALE_KM).
+    """
+    if search_tokenizer is None:
+        raise HTTPException(status_code=503, detail="Full-text search is not available")
+
+    with_distance = lat is not None and lng is not None
+    candidates = max(limit, SEARCH_RERANK_CANDIDATES) if with_distance else limit
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    category_filter = "AND p.category = :category" if category else ""
+    rows = db.execute(
+        text(f"""
+            SELECT p.id, bm25({SEARCH_TABLE}, {weights}) AS rank, p.latitude, p.longitude
+            FROM {SEARCH_TABLE}
+            JOIN service_providers p ON p.id = {SEARCH_TABLE}.rowid
+            WHERE {SEARCH_TABLE} MATCH :query AND p.is_active {category_filter}
+            ORDER BY rank
+            LIMIT :limit
+        """),
+        {"query": build_match_query(q), "category": category, "limit": candidates},
+    ).all()
+
+    results = []
+    for provider_id, rank, p_lat, p_lng in rows:
+        # bm25() в SQLite отрицательный: чем меньше, тем релевантнее
+        score = -rank
+        distance = None
+        if with_distance:
+            distance = haversine_m(lat, lng, p_lat, p_lng)
+            score /= 1 + distance / 1000 / SEARCH_DISTANCE_SCALE_KM
+        results.append((score, provider_id, distance))
+    results.sort(key=lambda result: (-result[0], result[1]))
+    return results[:limit]
@@ -0,0 +1,235 @@
+"""
+Статические снимки данных провайдеров для фронтенда на GitHub Pages (docs/).
+
+В каталог SNAPSHOT_DIR пишутся сжатые gzip JSON-шарды:
+- categories/{категория в URL-кодировке}.{hash}.json.gz - активные провайдеры категории (все поля)
+- tiles/{z}/{x}/{y}.{hash}.json.gz - маркеры провайдеров тайла web mercator на зуме SNAPSHOT_TILE_ZOOM
+- manifest.json - версия данных и имена актуальных шардов
+
+Имя шарда содержит хеш содержимого, поэтому шарды можно кешировать навсегда;
+перепроверять нужно только manifest.json. Запись провайдера перегенерирует лишь
+затронутые шарды (его категорию и тайл до и после изменения) в фоновом потоке.
+Полная сборка: python export_snapshots.py [каталог] или POST /api/admin/snapshots/rebuild.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import ServiceProvider, DataVersion
+from data_version import PROVIDERS
+from fast_json import encode_rows
+from geo import filter_in_bbox, tile_of, tile_bounds
+from sparse_fields import PROVIDER_FIELDS, provider_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_TILE_ZOOM = int(os.getenv("SNAPSHOT_TILE_ZOOM", "8"))
+MANIFEST_NAME = "manifest.json"
+TILE_FIELDS = ("id", "name", "category", "latitude", "longitude")
+
+
+def _shard_keys(point, zoom: int):
+    x, y = tile_of(point.latitude, point.longitude, zoom)
+    return {("category", point.category), ("tile", f"{zoom}/{x}/{y}")}
+
+
+def _shard_path(kind: str, key: str, digest: str) -> str:
+    if kind == "category":
+        # Категория приходит из данных провайдера: экранируем, чтобы она не могла выйти за пределы каталога
+        return f"categories/{quote(key, safe='')}.{digest}.json.gz"
+    return f"tiles/{key}.{digest}.json.gz"
+
+
+class SnapshotWriter:
+    def __init__(self, directory, zoom: int = SNAPSHOT_TILE_ZOOM):
+        self.directory = directory
+        self.zoom = zoom
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    # ----- файлы -----
+
+    def _path(self, name: str) -> str:
+        # Имена из старого манифеста тоже не должны указывать за пределы каталога
+        root = os.path.abspath(self.directory)
+        path = os.path.abspath(os.path.join(root, name))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"Snapshot path outside of {root}: {name}")
+        return path
+
+    def _write_atomic(self, name: str, content: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _remove(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._path(MANIFEST_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"categories": {}, "tiles": {}}
+
+    def _write_shard(self, kind: str, key: str, rows, fields) -> dict:
+        # mtime=0 - одинаковые данные дают одинаковые байты и хеш
+        content = gzip.compress(encode_rows(rows, fields), mtime=0)
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        name = _shard_path(kind, key, digest)
+        if not os.path.exists(self._path(name)):
+            self._write_atomic(name, content)
+        return {"file": name, "count": len(rows)}
+
+    def _locked(self):
+        """Блокировка каталога: в него пишут все воркеры"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(self._path(".lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _save_manifest(self, db, manifest: dict, replaced):
+        manifest["version"] = db.execute(
+            select(DataVersion.version).where(DataVersion.name == PROVIDERS)
+        ).scalar() or 0
+        manifest["generated_at"] = datetime.utcnow().isoformat()
+        manifest["tile_zoom"] = self.zoom
+        manifest["fields"] = {"categories": list(PROVIDER_FIELDS), "tiles": list(TILE_FIELDS)}
+        self._write_atomic(
+            MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        )
+        # Старые шарды удаляются только после того, как манифест на них больше не ссылается
+        current = {entry["file"] for section in ("categories", "tiles") for entry in manifest[section].values()}
+        for name in set(replaced) - current:
+            self._remove(name)
+
+    # ----- сборка -----
+
+    def rebuild(self, db) -> dict:
+        """Полная пересборка всех шардов"""
+        rows = db.execute(
+            select(*provider_columns(PROVIDER_FIELDS))
+            .where(ServiceProvider.is_active == True)
+            .order_by(ServiceProvider.id)
+        ).all()
+        lat_index = PROVIDER_FIELDS.index("latitude")
+        lng_index = PROVIDER_FIELDS.index("longitude")
+        category_index = PROVIDER_FIELDS.index("category")
+        tile_indexes = [PROVIDER_FIELDS.index(name) for name in TILE_FIELDS]
+
+        by_category = {}
+        by_tile = {}
+        for row in rows:
+            by_category.setdefault(row[category_index], []).append(row)
+            x, y = tile_of(row[lat_index], row[lng_index], self.zoom)
+            by_tile.setdefault(f"{self.zoom}/{x}/{y}", []).append(
+                tuple(row[i] for i in tile_indexes)
+            )
+
+        with self._lock, self._locked():
+            old = self._read_manifest()
+            replaced = [
+                entry["file"] for section in ("categories", "tiles") for entry in old.get(section, {}).values()
+            ]
+            manifest = {
+                "categories": {
+                    category: self._write_shard("category", category, category_rows, PROVIDER_FIELDS)
+                    for category, category_rows in by_category.items()
+                },
+                "tiles": {
+                    key: self._write_shard("tile", key, tile_rows, TILE_FIELDS)
+                    for key, tile_rows in by_tile.items()
+                },
+            }
+            self._save_manifest(db, manifest, replaced)
+        logger.info(
+            f"Snapshots rebuilt: {len(manifest['categories'])} category and {len(manifest['tiles'])} tile shards"
+        )
+        return manifest
+
+    def _query_shard(self, db, kind: str, key: str):
+        if kind == "category":
+            query = select(*provider_columns(PROVIDER_FIELDS)).where(ServiceProvider.category == key)
+            fields = PROVIDER_FIELDS
+        else:
+            zoom, x, y = (int(part) for part in key.split("/"))
+            query = filter_in_bbox(select(*provider_columns(TILE_FIELDS)), *tile_bounds(zoom, x, y))
+            fields = TILE_FIELDS
+        rows = db.execute(query.where(ServiceProvider.is_active == True).order_by(ServiceProvider.id)).all()
+        if kind == "tile":
+            # Точки на общей границе попадают в bbox соседних тайлов: оставляем свои
+            lat_index, lng_index = fields.index("latitude"), fields.index("longitude")
+            rows = [row for row in rows if tile_of(row[lat_index], row[lng_index], zoom) == (x, y)]
+        return rows, fields
+
+    def update(self, changes):
+        """Перегенерирует шарды, затронутые изменениями (before, after) из ProviderPoint"""
+        keys = set()
+        for before, after in changes:
+            for point in (before, after):
+                if point is not None:
+                    keys |= _shard_keys(point, self.zoom)
+        if not keys:
+            return
+
+        db = SessionLocal()
+        try:
+            with self._lock, self._locked():
+                manifest = self._read_manifest()
+                replaced = []
+                for kind, key in sorted(keys):
+                    section = manifest.setdefault("categories" if kind == "category" else "tiles", {})
+                    if key in section:
+                        replaced.append(section[key]["file"])
+                    rows, fields = self._query_shard(db, kind, key)
+                    if rows:
+                        section[key] = self._write_shard(kind, key, rows, fields)
+                    else:
+                        section.pop(key, None)
+                self._save_manifest(db, manifest, replaced)
+        finally:
+            db.close()
+        logger.info(f"Snapshots updated: {len(keys)} shards")
+
+
+snapshot_writer = SnapshotWriter(SNAPSHOT_DIR)
+# Один поток: обновления шардов выполняются по очереди и не задерживают ответы API
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshots")
+
+
+def _update_logged(changes):
+    try:
+        snapshot_writer.update(changes)
+    except Exception as e:
+        logger.error(f"Error updating snapshots: {e}", exc_info=True)
+
+
+def schedule_snapshot_update(changes):
+    """Ставит в очередь обновление шардов (ничего не делает без SNAPSHOT_DIR)"""
+    if snapshot_writer.enabled:
+        _executor.submit(_update_logged, list(changes))
@@ -0,0 +1,52 @@
+"""
+Выборочные поля провайдера (?fields=name,category,latitude,longitude).
+
+Из БД читаются только запрошенные колонки, ответ сериализуется динамической моделью
+с теми же типами полей, что и ServiceProviderResponse. id добавляется всегда:
+по нему работают курсоры и клиентские кеши.
+"""
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import HTTPException
+from pydantic import ConfigDict, TypeAdapter, create_model
+
+from models import ServiceProvider
+from schemas import ServiceProviderResponse
+
+PROVIDER_FIELDS = tuple(ServiceProviderResponse.model_fields)
+
+
+def parse_fields(fields: Optional[str]):
+    """
+    Нормализованный кортеж полей в порядке модели или None (все поля).
+    Неизвестные поля - 400.
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(PROVIDER_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    normalized = tuple(name for name in PROVIDER_FIELDS if name in requested)
+    return None if normalized == PROVIDER_FIELDS else normalized
+
+
+def provider_columns(fields):
+    return [getattr(ServiceProvider, name) for name in fields]
+
+
+@lru_cache(maxsize=128)
+def fields_adapters(fields):
+    """(adapter, list_adapter) для модели только с полями fields"""
+    model = create_model(
+        "ServiceProviderFields",
+        __config__=ConfigDict(from_attributes=True),
+        **{
+            name: (ServiceProviderResponse.model_fields[name].annotation,
+                   ServiceProviderResponse.model_fields[name])
+            for name in fields
+        },
+    )
+    return TypeAdapter(model), TypeAdapter(List[model])
@@ -0,0 +1,176 @@
+"""
+Подсказки для строки поиска: in-memory индекс префиксов по названиям провайдеров и категориям.
+
+Индекс - отсортированный список ключей, поиск по префиксу - bisect, поэтому запрос
+не ходит в БД. Каждое название индексируется с начала каждого слова, так что
+"джал" находит "Сантехник 'Джалал-Абад Мастер'". Записи провайдеров обновляют
+индекс инкрементально (см. _providers_changed в main.py).
+"""
+import bisect
+import logging
+import threading
+
+from sqlalchemy import select
+
+from models import ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+# Категории показываются раньше провайдеров
+KIND_CATEGORY = 0
+KIND_PROVIDER = 1
+# Сколько совпадений просматривать перед ранжированием
+SUGGEST_SCAN_LIMIT = 500
+
+_STRIP_CHARS = "'\"«»“”()[],.!?"
+
+
+def normalize(value: str) -> str:
+    return value.casefold().replace("ё", "е").strip()
+
+
+def _word_keys(label: str):
+    """Ключи для каждого слова: хвост строки, начиная с этого слова"""
+    words = [word.strip(_STRIP_CHARS) for word in normalize(label).split()]
+    words = [word for word in words if word]
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """
+    Отсортированный список провайдеров (key, kind, ref, label, category, position);
+    категории (их единицы) хранятся отдельно, чтобы не занимать лимит просмотра
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._provider_entries = {}
+        self._category_entries = []
+        self.loaded = False
+        # Растет при каждом invalidate/apply: загрузка, во время которой индекс менялся,
+        # не устанавливается (пропущенная apply запись в ней могла отсутствовать)
+        self._generation = 0
+
+    def _insert(self, entries):
+        for entry in entries:
+            bisect.insort(self._entries, entry)
+
+    def _remove(self, entries):
+        for entry in entries:
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    @staticmethod
+    def _provider_entries_for(provider_id: int, name: str, category: str):
+        return [
+            (key, KIND_PROVIDER, provider_id, name, category, position)
+            for position, key in enumerate(_word_keys(name))
+        ]
+
+    def load(self, providers, categories, generation=None):
+        """
+        providers - последовательность (id, name, category) активных провайдеров;
+        generation - поколение на момент начала их чтения (см. rebuild)
+        """
+        entries = []
+        provider_entries = {}
+        for provider_id, name, category in providers:
+            provider_entries[provider_id] = self._provider_entries_for(provider_id, name, category)
+            entries.extend(provider_entries[provider_id])
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                logger.info("Suggest index changed while loading, not installing")
+                return
+            self._entries = sorted(entries)
+            self._provider_entries = provider_entries
+            self._category_entries = []
+            self.loaded = True
+            self._set_categories(categories)
+        logger.info(f"Suggest index loaded: {len(provider_entries)} providers")
+
+    def rebuild(self, db, categories):
+        with self._lock:
+            generation = self._generation
+        rows = db.execute(
+            select(ServiceProvider.id, ServiceProvider.name, ServiceProvider.category)
+            .where(ServiceProvider.is_active == True)
+        ).all()
+        self.load(rows, categories, generation)
+
+    def ensure_loaded(self, db, categories):
+        if not self.loaded:
+            self.rebuild(db, categories)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.loaded = False
+
+    def _set_categories(self, categories):
+        self._category_entries = []
+        for cat in categories:
+            for label in {cat["label"], cat["value"]}:
+                for position, key in enumerate(_word_keys(label)):
+                    self._category_entries.append(
+                        (key, KIND_CATEGORY, cat["value"], cat["label"], cat["value"], position)
+                    )
+
+    def set_categories(self, categories):
+        with self._lock:
+            if self.loaded:
+                self._set_categories(categories)
+
+    def apply(self, changes):
+        """Патчит индекс по списку изменений (before, after) из ProviderPoint или None"""
+        with self._lock:
+            self._generation += 1
+            if not self.loaded:
+                return
+            for before, after in changes:
+                provider_id = (after or before).id
+                self._remove(self._provider_entries.pop(provider_id, []))
+                if after is not None and after.is_active:
+                    entries = self._provider_entries_for(provider_id, after.name, after.category)
+                    self._provider_entries[provider_id] = entries
+                    self._insert(entries)
+
+    def suggest(self, prefix: str, limit: int = 10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        matches = {}
+
+        def add(entry):
+            key, kind, ref, label, category, position = entry
+            # Одно и то же название может совпасть несколькими словами: берем лучшее
+            best = matches.get((kind, ref))
+            if best is None or position < best[0]:
+                matches[(kind, ref)] = (position, label, category)
+
+        with self._lock:
+            for entry in self._category_entries:
+                if entry[0].startswith(prefix):
+                    add(entry)
+            # Лимит просмотра - только для провайдеров
+            i = bisect.bisect_left(self._entries, (prefix,))
+            end = min(len(self._entries), i + SUGGEST_SCAN_LIMIT)
+            while i < end and self._entries[i][0].startswith(prefix):
+                add(self._entries[i])
+                i += 1
+        # Категории, затем совпадения с начала названия, затем короткие названия
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (item[0][0], item[1][0] > 0, len(item[1][1]), item[1][1]),
+        )
+        suggestions = []
+        for (kind, ref), (_, label, category) in ranked[:limit]:
+            if kind == KIND_CATEGORY:
+                suggestions.append({"type": "category", "value": ref, "label": label})
+            else:
+                suggestions.append({"type": "provider", "id": ref, "label": label, "category": category})
+        return suggestions
+
+
+suggest_index = PrefixIndex()
@@ -1,16 +1,84 @@
 import os
+import re
 import shutil
 from fastapi import UploadFile, HTTPException
+from fastapi.responses import JSONResponse
 from pathlib import Path
+from starlette.concurrency import run_in_threadpool
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+CHUNK_SIZE = 64 * 1024
+# Размер всего запроса с фото: файл плюс запас на остальные поля формы и разметку multipart
+MAX_UPLOAD_REQUEST_SIZE = MAX_FILE_SIZE + 256 * 1024
+# Endpoints, принимающие фото (массовый импорт администратора сюда не входит)
+UPLOAD_PATHS = re.compile(r"^/api/(upload|auth/register|providers/\d+)$")
+
+# Сигнатуры форматов: расширения, которым должно соответствовать содержимое
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", {".jpg", ".jpeg"}),
+    (b"\x89PNG\r\n\x1a\n", {".png"}),
+    (b"GIF87a", {".gif"}),
+    (b"GIF89a", {".gif"}),
+]
+
+
+def _matches_extension(head: bytes, file_ext: str) -> bool:
+    """Проверяет по первым байтам, что файл действительно изображение с этим расширением"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return file_ext == ".webp"
+    return any(head.startswith(signature) and file_ext in extensions for signature, extensions in _IMAGE_SIGNATURES)
+
+
+def _too_large():
+    return HTTPException(status_code=400, detail="Файл слишком большой (макс. 5MB)")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничивает размер запросов с фото до разбора формы: FastAPI читает multipart
+    целиком раньше, чем вызывается endpoint. Запрос с Content-Length больше лимита
+    отклоняется без чтения тела, а при chunked-передаче чтение обрывается на лимите.
+    """
+
+    def __init__(self, app, max_size: int = MAX_UPLOAD_REQUEST_SIZE, paths=UPLOAD_PATHS):
+        self.app = app
+        self.max_size = max_size
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT") or not self.paths.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_size:
+            response = JSONResponse({"detail": "Request too large"}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise HTTPException(status_code=413, detail="Request too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
 
 async def save_uploaded_file(file: UploadFile) -> str:
-    """Сохраняет загруженный файл и возвращает URL"""
+    """
+    Сохраняет загруженный файл и возвращает URL.
+    Файл читается по частям во временный файл (запись на диск - в threadpool) и
+    переименовывается атомарно; превышение размера прерывает загрузку сразу.
+    """
     if not file:
         return None
     
@@ -18,24 +86,49 @@ async def save_uploaded_file(file: UploadFile) -> str:
     file_ext = Path(file.filename).suffix.lower()
     if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Недопустимый формат файла")
+    # Размер уже известен, если multipart разобран целиком
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise _too_large()
     
     # Генерируем уникальное имя файла
     import uuid
     file_name = f"{uuid.uuid4()}{file_ext}"
     file_path = UPLOAD_DIR / file_name
+    tmp_path = UPLOAD_DIR / f".{file_name}.tmp"
     
-    # Сохраняем файл и проверяем размер
-    file_content = await file.read()
-    if len(file_content) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="Файл слишком большой (макс. 5MB)")
-    
-    # Сохраняем файл
-    with open(file_path, "wb") as buffer:
-        buffer.write(file_content)
+    out = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        size = 0
+        first = True
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if first:
+                if not _matches_extension(chunk, file_ext):
+                    raise HTTPException(status_code=400, detail="Содержимое файла не соответствует формату")
+                first = False
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise _too_large()
+            await run_in_threadpool(out.write, chunk)
+        if first:
+            raise HTTPException(status_code=400, detail="Пустой файл")
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(os.replace, tmp_path, file_path)
+    except BaseException:
+        await run_in_threadpool(_discard, out, tmp_path)
+        raise
     
     # Возвращаем относительный URL
     return f"/uploads/{file_name}"
 
+
+def _discard(out, tmp_path: Path):
+    out.close()
+    tmp_path.unlink(missing_ok=True)
+
+
 def delete_file(file_url: str):
     """Удаляет файл по URL"""
     if file_url and file_url.startswith("/uploads/"):
@@ -0,0 +1,260 @@
+"""
+Векторные тайлы (Mapbox Vector Tile 2.1) с маркерами активных провайдеров.
+
+Тайл содержит один слой "providers": точка на провайдера, id фичи - id провайдера,
+свойства name и category. Protobuf кодируется вручную (нужны всего три сообщения).
+Готовые непустые тайлы зумов до MAX_CACHED_TILE_ZOOM кешируются на диске в
+TILE_CACHE_DIR/{c_категория|_all}/{z}/{x}/{y}.mvt, не больше TILE_CACHE_MAX_FILES файлов
+(сверх лимита тайлы отдаются без кеширования); запись провайдера удаляет тайлы
+всех зумов, в которые он попадал до и после изменения. Тайл, собранный до чужой
+записи, не попадает в кеш (версия данных сверяется перед записью файла), а на
+случай оставшейся гонки закешированный тайл живет не дольше TILE_CACHE_TTL секунд.
+Скрипты, которые пишут в БД напрямую (init_data.py, reset_data.py), кеш не трогают:
+после них каталог TILE_CACHE_DIR нужно очистить.
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from models import ServiceProvider, DataVersion
+from data_version import PROVIDERS
+from geo import filter_in_bbox, mercator_xy, tile_of, tile_bounds
+
+logger = logging.getLogger(__name__)
+
+TILE_CACHE_DIR = Path(os.getenv("TILE_CACHE_DIR", "tile_cache"))
+MAX_TILE_ZOOM = 22
+# Глубже тайлов слишком много, а собираются они по индексу быстро
+MAX_CACHED_TILE_ZOOM = int(os.getenv("MAX_CACHED_TILE_ZOOM", "16"))
+TILE_CACHE_MAX_FILES = int(os.getenv("TILE_CACHE_MAX_FILES", "100000"))
+TILE_CACHE_TTL = int(os.getenv("TILE_CACHE_TTL", "600"))
+TILE_EXTENT = 4096
+TILE_LAYER = "providers"
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+_ALL_CATEGORIES = "_all"
+
+_cache_lock = threading.Lock()
+# Число файлов в кеше: считается при первом обращении, дальше ведется этим процессом
+_cached_files = None
+
+# Protobuf wire types
+_VARINT = 0
+_LENGTH_DELIMITED = 2
+# Geometry: MoveTo с одной точкой
+_MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+_GEOM_POINT = 1
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _uint_field(field: int, value: int) -> bytes:
+    return _key(field, _VARINT) + _varint(value)
+
+
+def _bytes_field(field: int, value: bytes) -> bytes:
+    return _key(field, _LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def _packed_field(field: int, values) -> bytes:
+    return _bytes_field(field, b"".join(_varint(value) for value in values))
+
+
+def _string_value(value: str) -> bytes:
+    # Value.string_value = 1
+    return _bytes_field(1, value.encode("utf-8"))
+
+
+def encode_tile(points, extent: int = TILE_EXTENT) -> bytes:
+    """
+    points - (id, px, py, name, category), где px/py - координаты внутри тайла
+    в единицах extent. Пустой список дает пустой тайл.
+    """
+    if not points:
+        return b""
+    keys = ["name", "category"]
+    values = []
+    value_index = {}
+
+    def value_id(value: str) -> int:
+        if value not in value_index:
+            value_index[value] = len(values)
+            values.append(value)
+        return value_index[value]
+
+    features = []
+    for provider_id, px, py, name, category in points:
+        tags = (0, value_id(name or ""), 1, value_id(category))
+        geometry = (_MOVE_TO_ONE, _zigzag(px), _zigzag(py))
+        features.append(
+            _uint_field(1, provider_id)          # Feature.id
+            + _packed_field(2, tags)             # Feature.tags
+            + _uint_field(3, _GEOM_POINT)        # Feature.type
+            + _packed_field(4, geometry)         # Feature.geometry
+        )
+
+    layer = b"".join(
+        [_uint_field(15, 2), _bytes_field(1, TILE_LAYER.encode("utf-8"))]  # version, name
+        + [_bytes_field(2, feature) for feature in features]
+        + [_bytes_field(3, key.encode("utf-8")) for key in keys]
+        + [_bytes_field(4, _string_value(value)) for value in values]
+        + [_uint_field(5, extent)]
+    )
+    return _bytes_field(3, layer)  # Tile.layers
+
+
+def validate_tile(z: int, x: int, y: int):
+    if not 0 <= z <= MAX_TILE_ZOOM:
+        raise HTTPException(status_code=400, detail=f"Zoom must be between 0 and {MAX_TILE_ZOOM}")
+    n = 1 << z
+    if not (0 <= x < n and 0 <= y < n):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+
+def build_tile(db, z: int, x: int, y: int, category=None) -> bytes:
+    """Тайл из пространственного индекса"""
+    query = select(
+        ServiceProvider.id,
+        ServiceProvider.latitude,
+        ServiceProvider.longitude,
+        ServiceProvider.name,
+        ServiceProvider.category,
+    ).where(ServiceProvider.is_active == True)
+    query = filter_in_bbox(query, *tile_bounds(z, x, y), category=category)
+
+    points = []
+    for provider_id, lat, lng, name, provider_category in db.execute(query.order_by(ServiceProvider.id)):
+        # Точка на общей границе попадает в bbox соседних тайлов: оставляем только в своем
+        if tile_of(lat, lng, z) != (x, y):
+            continue
+        fx, fy = mercator_xy(lat, lng, z)
+        px = min(int((fx - x) * TILE_EXTENT), TILE_EXTENT - 1)
+        py = min(int((fy - y) * TILE_EXTENT), TILE_EXTENT - 1)
+        points.append((provider_id, px, py, name, provider_category))
+    return encode_tile(points)
+
+
+def _cache_path(category, z: int, x: int, y: int) -> Path:
+    # Категория приходит из запроса: экранируем, чтобы она не могла выйти за пределы каталога
+    directory = f"c_{quote(category, safe='')}" if category else _ALL_CATEGORIES
+    return TILE_CACHE_DIR / directory / str(z) / str(x) / f"{y}.mvt"
+
+
+def _count_cached_files() -> int:
+    return sum(
+        1 for _, _, files in os.walk(TILE_CACHE_DIR) for name in files if name.endswith(".mvt")
+    )
+
+
+def _reserve_cache_slot() -> bool:
+    global _cached_files
+    with _cache_lock:
+        if _cached_files is None:
+            _cached_files = _count_cached_files()
+        if _cached_files >= TILE_CACHE_MAX_FILES:
+            return False
+        _cached_files += 1
+        return True
+
+
+def _release_cache_slots(count: int):
+    global _cached_files
+    with _cache_lock:
+        if _cached_files is not None:
+            _cached_files = max(0, _cached_files - count)
+
+
+def _providers_version(db) -> int:
+    return db.execute(select(DataVersion.version).where(DataVersion.name == PROVIDERS)).scalar() or 0
+
+
+def _read_cached(path: Path):
+    """Содержимое тайла из кеша или None, если его нет или он старше TILE_CACHE_TTL"""
+    try:
+        with open(path, "rb") as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > TILE_CACHE_TTL:
+                return None
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store_tile(db, path: Path, content: bytes, version: int):
+    if not _reserve_cache_slot():
+        return
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}.{threading.get_ident()}")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        existed = path.exists()
+        tmp_path.write_bytes(content)
+        if _providers_version(db) != version:
+            # Пока тайл собирался, провайдеров изменили: тайл мог устареть
+            tmp_path.unlink()
+            _release_cache_slots(1)
+            return
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _release_cache_slots(1)
+        logger.warning(f"Error caching tile {path}: {e}")
+        return
+    if existed:
+        # Тайл уже записал параллельный запрос: файлов не прибавилось
+        _release_cache_slots(1)
+
+
+def get_tile(db, z: int, x: int, y: int, category=None) -> bytes:
+    """Тайл из дискового кеша или собранный заново"""
+    validate_tile(z, x, y)
+    if z > MAX_CACHED_TILE_ZOOM:
+        return build_tile(db, z, x, y, category)
+    path = _cache_path(category, z, x, y)
+    content = _read_cached(path)
+    if content is not None:
+        return content
+    version = _providers_version(db)
+    content = build_tile(db, z, x, y, category)
+    # Пустые тайлы (океан, пустые регионы) собираются быстро и занимали бы почти весь кеш
+    if content:
+        _store_tile(db, path, content, version)
+    return content
+
+
+def invalidate_tiles(changes):
+    """Удаляет закешированные тайлы всех зумов, которые содержали или теперь содержат провайдеров"""
+    points = {point for change in changes for point in change if point is not None}
+    paths = set()
+    for point in points:
+        for z in range(MAX_CACHED_TILE_ZOOM + 1):
+            x, y = tile_of(point.latitude, point.longitude, z)
+            paths.add(_cache_path(None, z, x, y))
+            paths.add(_cache_path(point.category, z, x, y))
+    removed = 0
+    for path in paths:
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Error removing cached tile {path}: {e}")
+    _release_cache_slots(removed)